@@ -12,32 +12,355 @@ Machine learning & data mining functions
 -- Coded by Simon Perneel
 -- mailto:Simon.Perneel@UGent.be
 """
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+import numpy as np
 import pandas as pd
-from apyori import apriori
+from scipy import sparse
 
 from mobiledna.core.appevents import Appevents
 import mobiledna.core.help as hlp
+from mobiledna.core.help import log
+
+# Same record structure as the apyori package
+RelationRecord = namedtuple('RelationRecord', ('items', 'support', 'ordered_statistics'))
+OrderedStatistic = namedtuple('OrderedStatistic', ('items_base', 'items_add', 'confidence', 'lift'))
+
+# Number of set bits in every byte value
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def get_incidence(apps: Appevents) -> tuple:
+    """
+    Build a sparse session x app incidence matrix (1 if app was used in session) from the session sequences.
+
+    :param apps: Appevents object
+    :return: incidence matrix (csc), application names per column
+    """
+
+    sequences = apps.get_session_sequences(materialize=False)
+
+    rows = np.repeat(np.arange(len(sequences)), sequences.lengths())
+    cols = sequences.codes
+    known = cols >= 0
+
+    incidence = sparse.csc_matrix((np.ones(known.sum(), dtype=np.int32), (rows[known], cols[known])),
+                                  shape=(len(sequences), len(sequences.applications)))
+    incidence.sum_duplicates()
+    incidence.data[:] = 1
+
+    return incidence, sequences.applications
+
+
+def pack_bitsets(incidence: sparse.csc_matrix) -> np.ndarray:
+    """
+    Pack the columns of an incidence matrix into bitsets (one row of bytes per item)
+
+    :param incidence: session x item incidence matrix (csc)
+    :return: items x bytes array
+    """
+
+    n_sessions, n_items = incidence.shape
+    bitsets = np.zeros((n_items, (n_sessions + 7) // 8), dtype=np.uint8)
+
+    for item in range(n_items):
+        column = np.zeros(n_sessions, dtype=bool)
+        column[incidence.indices[incidence.indptr[item]:incidence.indptr[item + 1]]] = True
+        bitsets[item] = np.packbits(column)
+
+    return bitsets
+
+
+def count_support(bitsets: np.ndarray, candidates: np.ndarray, batch_bytes=2 ** 26) -> np.ndarray:
+    """
+    Count the sessions that contain all items of each candidate itemset (AND of bitsets, then popcount).
+
+    :param bitsets: items x bytes array (see pack_bitsets)
+    :param candidates: candidates x k array of item indices
+    :param batch_bytes: memory budget for intermediate bitsets
+    :return: count per candidate
+    """
 
+    counts = np.zeros(len(candidates), dtype=np.int64)
+    batch = max(1, batch_bytes // max(1, bitsets.shape[1]))
 
-def get_association_rules(apps: Appevents, min_confidence=.5, min_support_tresh=0.005, min_lift=1, min_length=None):
+    for start in range(0, len(candidates), batch):
+        chunk = candidates[start:start + batch]
+        joint = bitsets[chunk[:, 0]].copy()
+        for k in range(1, chunk.shape[1]):
+            joint &= bitsets[chunk[:, k]]
+        counts[start:start + batch] = POPCOUNT[joint].sum(axis=1, dtype=np.int64)
+
+    return counts
+
+
+def join_candidates(frequent: np.ndarray) -> np.ndarray:
+    """
+    Apriori candidate generation: join frequent (k-1)-itemsets sharing a prefix, then drop candidates with an
+    infrequent (k-1)-subset.
+
+    :param frequent: sorted f x (k-1) array of frequent itemsets (item indices in ascending order)
+    :return: sorted c x k array of candidates
+    """
+
+    if len(frequent) == 0:
+        return np.empty((0, frequent.shape[1] + 1), dtype=np.int64)
+
+    # Group itemsets on prefix (rows are sorted, so equal prefixes are contiguous)
+    prefixes = frequent[:, :-1]
+    starts = np.flatnonzero(np.r_[True, (prefixes[1:] != prefixes[:-1]).any(axis=1)])
+    stops = np.r_[starts[1:], len(frequent)]
+
+    candidates = []
+    for start, stop in zip(starts, stops):
+        if stop - start < 2:
+            continue
+        left, right = np.triu_indices(stop - start, k=1)
+        block = np.empty((len(left), frequent.shape[1] + 1), dtype=np.int64)
+        block[:, :-1] = frequent[start + left]
+        block[:, -1] = frequent[start + right, -1]
+        candidates.append(block)
+
+    if not candidates:
+        return np.empty((0, frequent.shape[1] + 1), dtype=np.int64)
+
+    candidates = np.concatenate(candidates)
+
+    # Prune: every (k-1)-subset must be frequent
+    known = set(map(tuple, frequent.tolist()))
+    keep = [all(subset in known for subset in combinations(candidate, len(candidate) - 1))
+            for candidate in map(tuple, candidates.tolist())]
+
+    return candidates[np.array(keep, dtype=bool)]
+
+
+def get_frequent_itemsets(incidence: sparse.csc_matrix, min_support: float, max_length=None) -> dict:
+    """
+    Level-wise (Apriori) frequent itemset search on an incidence matrix. Single items are counted on the column
+    sums, pairs with one sparse product, longer itemsets on packed bitsets.
+
+    :param incidence: session x item incidence matrix (csc)
+    :param min_support: minimum support (share of sessions)
+    :param max_length: maximum itemset length
+    :return: {itemset (tuple of item indices): support}, level by level in lexicographic order
+    """
+
+    n_sessions = incidence.shape[0]
+    itemsets = {}
+
+    # Single items
+    supports = (np.asarray(incidence.sum(axis=0)).ravel() / n_sessions).tolist()
+    frequent = np.flatnonzero(np.array(supports) >= min_support)[:, None]
+    itemsets.update({(item,): supports[item] for item in frequent[:, 0].tolist()})
+
+    length = 2
+    bitsets = None
+
+    while len(frequent) and not (max_length and length > max_length):
+
+        # Pairs: co-occurrence counts from one sparse product
+        if length == 2:
+            items = frequent[:, 0]
+            sub = incidence[:, items]
+            co = sparse.triu((sub.T @ sub).tocoo(), k=1).tocoo()
+            candidates = np.column_stack([items[co.row], items[co.col]]).astype(np.int64)
+            counts = co.data
+
+            order = np.lexsort(candidates.T[::-1])
+            candidates, counts = candidates[order], counts[order]
+
+        # Longer itemsets: AND of bitsets
+        else:
+            candidates = join_candidates(frequent)
+            if bitsets is None and len(candidates):
+                bitsets = pack_bitsets(incidence)
+            counts = count_support(bitsets, candidates) if len(candidates) else np.empty(0, dtype=np.int64)
+
+        supports = counts / n_sessions
+        keep = supports >= min_support
+        frequent = candidates[keep]
+        itemsets.update(zip(map(tuple, frequent.tolist()), supports[keep].tolist()))
+
+        log(f'Found {len(frequent)} frequent itemsets of length {length}.', lvl=3)
+        length += 1
+
+    return itemsets
+
+
+def _eclat_prefix(prefix: int, conditional: sparse.csc_matrix, items: np.ndarray, n_sessions: int,
+                  min_support: float, max_length=None) -> list:
+    """
+    Depth-first (ECLAT) search of all frequent itemsets starting with one prefix item, on its conditional
+    database: the sessions containing the prefix item, restricted to the items that come after it.
+
+    :param prefix: prefix item
+    :param conditional: (sessions with prefix) x (later items) incidence matrix (csc)
+    :param items: item index per column of the conditional matrix
+    :param n_sessions: total number of sessions
+    :param min_support: minimum support (share of sessions)
+    :param max_length: maximum itemset length
+    :return: list of (itemset, support) tuples
+    """
+
+    results = []
+
+    if max_length == 1 or conditional.shape[1] == 0:
+        return results
+
+    bitsets = pack_bitsets(conditional)
+    counts = POPCOUNT[bitsets].sum(axis=1, dtype=np.int64)
+    keep = counts / n_sessions >= min_support
+
+    # Stack of (itemset, bitsets of its extensions, extension items, extension counts)
+    stack = [((prefix,), bitsets[keep], items[keep], counts[keep])]
+
+    while stack:
+        itemset, tidsets, extensions, supports = stack.pop()
+
+        for a in range(len(extensions)):
+            extended = itemset + (int(extensions[a]),)
+            results.append((extended, supports[a] / n_sessions))
+
+            if (max_length and len(extended) >= max_length) or a + 1 == len(extensions):
+                continue
+
+            joint = tidsets[a + 1:] & tidsets[a]
+            joint_counts = POPCOUNT[joint].sum(axis=1, dtype=np.int64)
+            frequent = joint_counts / n_sessions >= min_support
+
+            if frequent.any():
+                stack.append((extended, joint[frequent], extensions[a + 1:][frequent], joint_counts[frequent]))
+
+    return results
+
+
+def get_frequent_itemsets_eclat(incidence: sparse.csc_matrix, min_support: float, max_length=None,
+                                n_jobs=1) -> dict:
+    """
+    Frequent itemset search with ECLAT: the search space is partitioned on the first (prefix) item, and every
+    partition is mined depth-first on its own conditional database, optionally in parallel processes.
+    Returns the same itemsets as get_frequent_itemsets, in the same order.
+
+    :param incidence: session x item incidence matrix (csc)
+    :param min_support: minimum support (share of sessions)
+    :param max_length: maximum itemset length
+    :param n_jobs: number of processes (1 = run in this process, -1 = all cores)
+    :return: {itemset (tuple of item indices): support}, level by level in lexicographic order
+    """
+
+    n_sessions = incidence.shape[0]
+
+    # Single items
+    supports = (np.asarray(incidence.sum(axis=0)).ravel() / n_sessions).tolist()
+    frequent = np.flatnonzero(np.array(supports) >= min_support)
+    itemsets = {(item,): supports[item] for item in frequent.tolist()}
+
+    # Conditional database per prefix item (only later items can extend it)
+    rows = incidence[:, frequent].tocsr()
+    columns = rows.tocsc()
+
+    def partitions():
+        for p, item in enumerate(frequent.tolist()):
+            sessions = columns.indices[columns.indptr[p]:columns.indptr[p + 1]]
+            yield item, rows[sessions][:, p + 1:].tocsc(), frequent[p + 1:]
+
+    n_jobs = os.cpu_count() if n_jobs is None or n_jobs < 1 else n_jobs
+
+    if n_jobs == 1:
+        results = [_eclat_prefix(item, conditional, items, n_sessions, min_support, max_length)
+                   for item, conditional, items in partitions()]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_eclat_prefix, item, conditional, items, n_sessions, min_support, max_length)
+                       for item, conditional, items in partitions()]
+            results = [future.result() for future in futures]
+
+    # Same order as the level-wise search
+    found = sorted((itemset for partition in results for itemset in partition), key=lambda x: (len(x[0]), x[0]))
+    itemsets.update(found)
+
+    log(f'Found {len(itemsets)} frequent itemsets in {len(frequent)} partitions.', lvl=3)
+
+    return itemsets
+
+
+def get_rules(itemsets: dict, applications: np.ndarray, min_confidence=0.0, min_lift=0.0) -> list:
+    """
+    Turn frequent itemsets into association rules: every split of an itemset in a base (possibly empty) and an
+    added part, with confidence = support / support(base) and lift = confidence / support(added part).
+
+    :param itemsets: {itemset: support}, with all subsets of an itemset present (see get_frequent_itemsets)
+    :param applications: application name per item index
+    :param min_confidence: minimum confidence
+    :param min_lift: minimum lift
+    :return: list of RelationRecords
+    """
+
+    results = []
+
+    for itemset, support in itemsets.items():
+
+        statistics = []
+        for base_length in range(len(itemset)):
+            for base in combinations(itemset, base_length):
+                add = tuple(item for item in itemset if item not in base)
+                confidence = support / (itemsets[base] if base else 1.0)
+                lift = confidence / itemsets[add]
+
+                if confidence < min_confidence or lift < min_lift:
+                    continue
+
+                statistics.append(OrderedStatistic(frozenset(applications[list(base)]),
+                                                   frozenset(applications[list(add)]), confidence, lift))
+
+        if statistics:
+            results.append(RelationRecord(frozenset(applications[list(itemset)]), support, statistics))
+
+    return results
+
+
+def get_association_rules(apps: Appevents, min_confidence=.5, min_support_tresh=0.005, min_lift=1, min_length=None,
+                          max_length=None, algorithm='apriori', n_jobs=1):
     """
     Look for association rules to find apps that are frequently occuring together in a phone session.
-    Apriori algorithm is used (https://en.wikipedia.org/wiki/Apriori_algorithm)
+    Apriori (https://en.wikipedia.org/wiki/Apriori_algorithm) or ECLAT is used, on an integer-coded
+    session x app incidence matrix. ECLAT scales better to low support tresholds.
     :param apps: Appevents object
     :param min_confidence: minimal confidence of the association rule (confidence A=>B = prob(B|A))
     :param min_support_tresh: minimum support treshold of the rule (= support count / # sessions)
     :param min_lift: minimum lift for the rule (lift A=>B = prob(B|A)/prob(B)
     :param min_length: minimum number of apps in the rule
+    :param max_length: maximum number of apps in the rule
+    :param algorithm: 'apriori' or 'eclat'
+    :param n_jobs: number of processes to spread the ECLAT partitions over
+    :return: list of RelationRecords (items, support, ordered_statistics), as returned by apyori
     """
-    # group all sessions and get applications
-    transactions = list(apps.get_data().groupby('session')['application'].apply(list))
 
-    # Find association rules
-    results = list(apriori(transactions,
-                           min_support=min_support_tresh,
-                           min_confidence=min_confidence,
-                           min_lift=min_lift)
-                   )
+    if min_support_tresh <= 0:
+        raise Exception("ERROR: Minimum support must be > 0!")
+
+    if algorithm not in ('apriori', 'eclat'):
+        raise Exception(f"ERROR: Unknown algorithm '{algorithm}'. Choose 'apriori' or 'eclat'.")
+
+    # Session x app incidence, with apps sorted by name
+    incidence, applications = get_incidence(apps=apps)
+    order = np.argsort(applications, kind='stable')
+    incidence, applications = incidence[:, order], applications[order]
+
+    if incidence.shape[0] == 0:
+        return []
+
+    # Find frequent itemsets and association rules
+    if algorithm == 'eclat':
+        itemsets = get_frequent_itemsets_eclat(incidence=incidence, min_support=min_support_tresh,
+                                               max_length=max_length, n_jobs=n_jobs)
+    else:
+        itemsets = get_frequent_itemsets(incidence=incidence, min_support=min_support_tresh, max_length=max_length)
+    results = get_rules(itemsets=itemsets, applications=applications, min_confidence=min_confidence,
+                        min_lift=min_lift)
 
     if min_length:
         results = list(filter(lambda x: len(x.items) >= min_length, results))
@@ -15,17 +15,25 @@ ANNOTATION FUNCTIONS
 
 import datetime as dt
 import holidays
+import json
 import numpy as np
 import pandas as pd
 import random as rnd
+import threading
+import time
 from bs4 import BeautifulSoup
 from collections import Counter
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from os import listdir
-from os import makedirs
-from os.path import join, pardir
+from os import makedirs, remove
+from os.path import exists, join, pardir
 from requests import get
+from typing import Callable
 from tqdm import tqdm
 from google_play_scraper import app
+from google_play_scraper.exceptions import NotFoundError
 
 from mobiledna.core import help as hlp
 from mobiledna.core.help import log
@@ -35,105 +43,274 @@ from mobiledna.core.help import log
 # App categories #
 ##################
 
-def scrape_play_store(app_names: list, cache: dict, overwrite=False) -> (dict, list):
+# Append-only log of scraped apps (in cache directory), used to resume interrupted scraping runs
+SCRAPE_LOG = 'app_meta_scraped.jsonl'
+
+
+class RateLimiter:
     """
-    Scrape app meta data from Google play store.
+    Thread-safe limiter that spaces out calls, so that at most `rate` calls are made per second.
+    """
+
+    def __init__(self, rate: float = None):
+        self.interval = 1 / rate if rate else 0
+        self.next_call = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until the next call is allowed.
+        """
+
+        # Reserve a time slot...
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+
+        # ... and wait for it outside of the lock
+        if delay > 0:
+            time.sleep(delay)
+
+
+def scrape_app(app_name: str, fetch: Callable = app, limiter: RateLimiter = None, retries=3, backoff=1.0) -> dict:
+    """
+    Scrape meta data for a single app from the Google Play store, retrying on failure.
 
     :param app_name: the official app name (e.g., com.facebook.katana)
-    :return: dict with meta data for apps that got a hit, list with remaining apps
+    :param fetch: function that gets the app details (google_play_scraper.app, or a stub)
+    :param limiter: rate limiter shared between threads
+    :param retries: number of retries after a failed request (apps that are not found are not retried)
+    :param backoff: initial delay (in seconds) between retries, doubled after each attempt
+    :return: dict with meta data
     """
 
-    '''try:
-        cache = np.load(file=join(hlp.CACHE_DIR, 'app_meta_custom.npy'), allow_pickle=True).item()
-    except:
-        log('No cache was found for app meta data.', lvl=3)'''
+    for attempt in range(retries + 1):
+
+        # Respect the rate limit
+        if limiter:
+            limiter.wait()
+
+        # Find app details
+        try:
+            result = fetch(app_name, lang='en', country='be')
+            break
+
+        except NotFoundError:
+            raise
+
+        except Exception as e:
+            if attempt == retries:
+                raise
+
+            delay = backoff * 2 ** attempt * rnd.uniform(1, 1.5)
+            log(f'Problem for <{app_name}> - {e} (retrying in {round(delay, 2)} seconds)', lvl=3)
+            time.sleep(delay)
+
+    # Store all metadata for this app here
+    meta = {'source': 'play_store'}
+
+    # Get name, company and genre of the app
+    meta['name'] = result.get('title').split(':')[0]
+    meta['company'] = result.get('developer')
+    meta['genre'] = result.get('genre')
+
+    # Find purchase info
+    meta['purchases'] = result.get('minInstalls')
+
+    # Find rating info
+    meta['rating'] = result.get('score')
+
+    return meta
 
-    # Play store URL prefix
-    play_store_url = 'https://play.google.com/store/apps/details?id='
 
-    # Initialize dict of knowns and list of unknowns
-    known_apps = {}
-    unknown_apps = []
+def load_scrape_log(path: str = None) -> dict:
+    """
+    Load the meta data of apps that were scraped in an earlier (possibly interrupted) run.
+
+    :param path: if custom path, specify here, otherwise default cache location
+    :return: dict with meta data per app (later entries take precedence)
+    """
+
+    # If not specified, load from standard location
+    if not path:
+        path = join(hlp.CACHE_DIR, SCRAPE_LOG)
+
+    scraped = {}
+
+    if not exists(path):
+        return scraped
+
+    with open(path, 'r') as file:
+        for line in file:
+
+            # The last line may be incomplete if a run was interrupted while writing
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+            scraped[entry['app']] = entry['meta']
+
+    return scraped
+
+
+def scrape_play_store(app_names: list, cache: dict, overwrite=False, max_workers=8, rate_limit=4.0, retries=3,
+                      backoff=1.0, fetch: Callable = None, log_path: str = None) -> (dict, list):
+    """
+    Scrape app meta data from Google play store.
+    Apps are fetched concurrently, and each result is appended to a log in the cache directory as soon as it
+    comes in. If a run gets interrupted, the next run picks up where it stopped.
+
+    :param app_names: the official app names (e.g., com.facebook.katana)
+    :param cache: app meta data that is already known (dict, or MetaTable view from load_meta(copy=False))
+    :param overwrite: scrape apps again, even if they are in the cache
+    :param max_workers: number of threads fetching app details
+    :param rate_limit: maximum number of requests per second (None for no limit)
+    :param retries: number of retries after a failed request
+    :param backoff: initial delay (in seconds) between retries, doubled after each attempt
+    :param fetch: function that gets the app details (default: google_play_scraper.app)
+    :param log_path: if custom path for the scrape log, specify here, otherwise default cache location
+    :return: dict with meta data for apps that got a hit, list with remaining apps
+    """
+
+    # Defaults
+    fetch = fetch if fetch else app
+    log_path = log_path if log_path else join(hlp.CACHE_DIR, SCRAPE_LOG)
+    cache = dict(cache) if isinstance(cache, Mapping) else {}
+
+    # Apps that were handled in an interrupted run (fill the gaps in the cache)
+    scraped = load_scrape_log(path=log_path)
+    for app_name, meta in scraped.items():
+        if app_name not in cache or pd.isna(cache[app_name].get('genre')):
+            cache[app_name] = meta
+
+    # Initialize dict of knowns (apps that were scraped again in an interrupted run count as new info) and list of
+    # unknowns
+    known_apps = {app_name: scraped[app_name] for app_name in dict.fromkeys(app_names)
+                  if overwrite and app_name in scraped}
+    unknown_apps = [app_name for app_name in app_names
+                    if app_name in scraped and pd.isna(scraped[app_name].get('genre'))]
     cached_apps = 0
 
-    # Loop over app names
-    t_app_names = app_names if hlp.LOG_LEVEL > 1 else tqdm(app_names, desc="Scraping", position=0, leave=True)
-    for app_name in t_app_names:
+    # Select apps that still need scraping
+    to_scrape = []
+    for app_name in dict.fromkeys(app_names):
 
-        # Check with local cache, which must be a dict
-        if isinstance(cache, dict):
+        # Already handled in an interrupted run?
+        if app_name in scraped:
+            continue
 
-            # Is the app name in the cache's keys? Is the genre attached to it a NaN?
-            if app_name in cache.keys() and not pd.isna(cache[app_name]['genre']):
+        # Is the app name in the cache's keys? Is the genre attached to it a NaN?
+        if app_name in cache and not pd.isna(cache[app_name].get('genre')):
 
-                log(f"Info for f{app_name} is in cache.", lvl=3)
-                cached_apps += 1
+            log(f"Info for {app_name} is in cache.", lvl=3)
+            cached_apps += 1
 
-                # If we don't want to overwrite, skip this one
-                if not overwrite:
-                    continue
+            # If we don't want to overwrite, skip this one
+            if not overwrite:
+                continue
 
-        # Get attributes
-        try:
+        to_scrape.append(app_name)
 
-            # Store all metadata for this app here
-            meta = {'source': 'play_store'}
+    # Fetch app details concurrently, store results as they come in
+    hlp.set_dir(hlp.CACHE_DIR)
+    limiter = RateLimiter(rate=rate_limit)
 
-            # Find app details
-            result = app(
-                app_name,
-                lang='en',
-                country='be'
-            )
+    executor = ThreadPoolExecutor(max_workers=max_workers)
 
-            # Get name, company and genre of the app
-            meta['name'] = result.get('title').split(':')[0]
-            meta['company'] = result.get('developer')
-            meta['genre'] = result.get('genre')
+    with open(log_path, 'a') as log_file:
 
-            # Find purchase info
-            meta['purchases'] = result.get('minInstalls')
+        futures = {executor.submit(scrape_app, app_name=app_name, fetch=fetch, limiter=limiter, retries=retries,
+                                   backoff=backoff): app_name for app_name in to_scrape}
+        stored = set()
 
-            # Find rating info
-            meta['rating'] = result.get('score')
+        def store(future):
+            app_name = futures[future]
 
-            # Add it to the big dict (lol)
-            log(f'Got it! <{app_name}> meta data was scraped.', lvl=3)
-            known_apps[app_name] = meta
+            try:
+                meta = future.result()
+                log(f'Got it! <{app_name}> meta data was scraped.', lvl=3)
 
-        except Exception as e:
-            log(f'Problem for <{app_name}> - {e}', lvl=3)
-            # Fill in NaN's for apps that are not found in play store
-            meta['name'], meta['genre'], meta['custom_genre'] = np.NaN, np.NaN, np.NaN
+            except Exception as e:
+                log(f'Problem for <{app_name}> - {e}', lvl=3)
+
+                # Fill in NaN's for apps that are not found in play store
+                meta = {'source': 'play_store', 'name': np.NaN, 'genre': np.NaN, 'custom_genre': np.NaN}
+                unknown_apps.append(app_name)
+
+            # Add it to the big dict (lol), and to the log
             known_apps[app_name] = meta
-            unknown_apps.append(app_name)
+            log_file.write(json.dumps({'app': app_name, 'meta': meta}) + '\n')
+            log_file.flush()
+            stored.add(future)
+
+        t_futures = as_completed(futures)
+        t_futures = t_futures if hlp.LOG_LEVEL > 1 else tqdm(t_futures, desc="Scraping", total=len(futures),
+                                                             position=0, leave=True)
 
-        zzz = rnd.uniform(1, 3)
-        # print(f'Sleeping for {round(zzz, 2)} seconds.')
-        # print()
-        # time.sleep(zzz)
+        try:
+            for future in t_futures:
+                store(future)
+
+        except BaseException:
+            # Interrupted: drop the apps that are still queued, but log the ones that were fetched already,
+            # so the next run picks up from there (shutdown(cancel_futures=True) needs Python 3.9)
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+            for future in futures:
+                if future not in stored and future.done() and not future.cancelled():
+                    store(future)
+            log(f"Scraping interrupted, logged {len(stored)} apps to {log_path}.", lvl=1)
+            raise
+
+        finally:
+            executor.shutdown(wait=True)
 
     log(f"Obtained info for {len(known_apps)} apps.", lvl=2)
     log(f"Failed to get info on {len(unknown_apps)} apps.", lvl=2)
     log(f"{cached_apps} apps were already cached.", lvl=2)
 
     # Merge new info with cache
-    if isinstance(cache, dict):
+    # If we specified overwrite, store scraped info in cache over old info (unless the app wasn't found this time)
+    if overwrite:
+        known_apps = {**cache, **{app_name: meta for app_name, meta in known_apps.items()
+                                  if app_name not in cache or not pd.isna(meta.get('genre'))}}
+    # ... else retain app info
+    else:
+        # known_apps = cache|known_apps
+        known_apps = {**cache, **known_apps}
+
+    # Store app meta data cache, the log is no longer needed after that
+    hlp.save_meta(app_meta=known_apps)
+    remove(log_path)
 
-        # If we specified overwrite, store scraped info in cache over old info
-        if overwrite:
-            # known_apps |= cache # Python3.9
-            known_apps = {**known_apps, **cache}
-        # ... else retain app info
-        else:
-            # known_apps = cache|known_apps
-            known_apps = {**cache, **known_apps}
+    return known_apps, unknown_apps
 
-    # Store app meta data cache
-    hlp.set_dir(hlp.CACHE_DIR)
-    np.save(file=join('../cache', 'app_meta.npy'), arr=known_apps)
 
-    return known_apps, unknown_apps
+def map_applications(applications: pd.Series, resolve: Callable) -> pd.Categorical:
+    """
+    Annotate a column of application names by resolving each distinct application only once.
+
+    :param applications: application column (object or category dtype)
+    :param resolve: function that maps a single application name to its label
+    :return: categorical with one label per row
+    """
+
+    # Integer codes per row and the distinct applications they point to (missing values get code -1)
+    if isinstance(applications.dtype, pd.CategoricalDtype):
+        codes = applications.cat.codes.to_numpy()
+        uniques = applications.cat.categories
+    else:
+        codes, uniques = pd.factorize(applications)
+
+    # Build the lookup table (last slot is reserved for missing applications, so code -1 lands there)
+    labels = pd.Series([resolve(application) for application in uniques] + [resolve(np.nan)], dtype=object)
+    label_codes, label_uniques = pd.factorize(labels)
+
+    # Map back to rows with a single take
+    return pd.Categorical.from_codes(codes=label_codes[codes], categories=label_uniques)
 
 
 def add_category(df: pd.DataFrame, scrape=False, overwrite=False, custom_cat=True) -> pd.DataFrame:
@@ -148,7 +325,7 @@ def add_category(df: pd.DataFrame, scrape=False, overwrite=False, custom_cat=Tru
 
     # Load app meta data
     try:
-        meta = dict(np.load(join(hlp.CACHE_DIR, 'app_meta.npy'), allow_pickle=True).item())
+        meta = hlp.load_meta(copy=False)
     except Exception as e:
         log('No app meta data found. Scraping Play store.', lvl=1)
         scrape = True
@@ -164,7 +341,7 @@ def add_category(df: pd.DataFrame, scrape=False, overwrite=False, custom_cat=Tru
 
         meta, _ = scrape_play_store(app_names=applications, cache=meta, overwrite=overwrite)
 
-    # Add category field to row
+    # Category for a single application
     def adding_category_row(app: str):
         if custom_cat and app in meta.keys() and meta[app].get('custom_genre'):
 
@@ -177,7 +354,9 @@ def add_category(df: pd.DataFrame, scrape=False, overwrite=False, custom_cat=Tru
         else:
             return 'unknown'
 
-    df['category'] = [adding_category_row(x) for x in tqdm(df['application'], desc='Adding category', total=len(df))]
+    # Resolve once per distinct application, then broadcast to all rows
+    log('Adding category.', lvl=3)
+    df['category'] = map_applications(applications=df['application'], resolve=adding_category_row)
 
     return df
 
@@ -186,6 +365,35 @@ def add_category(df: pd.DataFrame, scrape=False, overwrite=False, custom_cat=Tru
 # App names #
 #############
 
+def resolve_appname(app: str, meta: dict, alias: bool = False):
+    """
+    Look up the name (or alias) of a single application in the app meta data.
+
+    :param app: application name (e.g., com.facebook.katana)
+    :param meta: app meta data dictionary
+    :param alias: use app alias (True) or PlayStore name (False)
+    :return: name or alias, 'unknown' if an aliased app has neither field, None if nothing was found
+    """
+
+    # Apps without meta data don't get a name
+    if app not in meta:
+        return None
+
+    fields = meta[app]
+
+    # PlayStore name
+    if not alias:
+        return fields.get('name') if fields.get('name') else None
+
+    # Alias, falling back on the PlayStore name
+    if 'alias' in fields:
+        return fields['alias'] if fields['alias'] else None
+    if 'name' in fields:
+        return fields['name'] if fields['name'] else None
+
+    return 'unknown'
+
+
 def add_appname(df: pd.DataFrame, scrape=False, overwrite=False, alias: bool = False) -> pd.DataFrame:
     """
     Take a data frame and annotate rows with name field, based on application name.
@@ -199,7 +407,7 @@ def add_appname(df: pd.DataFrame, scrape=False, overwrite=False, alias: bool = F
 
     # Load app meta data (with alias)
     try:
-        meta = dict(np.load(join(hlp.CACHE_DIR, 'app_meta.npy'), allow_pickle=True).item())
+        meta = hlp.load_meta(copy=False)
     except Exception as e:
         log('No app meta data found. Scraping Play store.', lvl=1)
         scrape = True
@@ -215,26 +423,10 @@ def add_appname(df: pd.DataFrame, scrape=False, overwrite=False, alias: bool = F
 
         meta, _ = scrape_play_store(app_names=applications, cache=meta, overwrite=overwrite)
 
-    # Add name field to row
-    def adding_appname_row(app: str):
-        if not alias and app in meta.keys() and meta[app]['name']:
-            try:
-                return meta[app]['name']
-            except:
-                return 'unknown'
-
-        if alias and app in meta.keys():
-            try:
-                if meta[app]['alias']:
-                    return meta[app]['alias']
-            except KeyError:
-                try:
-                    if meta[app]['name']:
-                        return meta[app]['name']
-                except KeyError:
-                    return 'unknown'
-
-    df['name'] = [adding_appname_row(x) for x in tqdm(df['application'], desc='Adding appname', total=len(df))]
+    # Resolve once per distinct application, then broadcast to all rows
+    log('Adding appname.', lvl=3)
+    df['name'] = map_applications(applications=df['application'],
+                                  resolve=lambda application: resolve_appname(app=application, meta=meta, alias=alias))
 
     return df
 
@@ -258,35 +450,51 @@ schedule = {
     4: [morning, afternoon]
 }
 
+# Time of day (hour bins, right edge included)
+TIME_OF_DAY_BINS = [-1, 4, 8, 12, 16, 20, 23]
+TIME_OF_DAY_LABELS = ['late_night', 'early_morning', 'morning', 'noon', 'eve', 'night']
+
+
+@lru_cache(maxsize=None)
+def get_calendar(first_year: int, last_year: int, holidays_separate=False) -> pd.Series:
+    """
+    Label every date in a range of years (holiday, week or weekend).
+    Calendars are cached, so they are only built once per process for a given range.
+    WARNING: the returned series is shared between callers, don't modify it.
+
+    :param first_year: first year in the calendar
+    :param last_year: last year in the calendar (included)
+    :param holidays_separate: label Belgian holidays as 'holiday' instead of 'week'
+    :return: categorical series with day types, indexed by date
+    """
+
+    dates = pd.date_range(start=f'{first_year}-01-01', end=f'{last_year}-12-31', freq='D')
+
+    # Weekend or regular weekday?
+    labels = np.where(dates.weekday >= 5, 'weekend', 'week').astype(object)
+    categories = ['week', 'weekend']
+
+    # Holiday? (weekends take precedence)
+    if holidays_separate:
+        is_holiday = np.array([date in be_holidays for date in dates.date], dtype=bool)
+        labels[is_holiday & (dates.weekday < 5)] = 'holiday'
+        categories.append('holiday')
+
+    return pd.Series(pd.Categorical(labels, categories=categories), index=dates, name='DOTW')
+
 
 def add_date_annotation(df: pd.DataFrame, date_cols: list, holidays_separate=False) -> pd.DataFrame:
     """
     Annotate dates in dataframe (holiday, week or weekend)
     :param df: data frame
     :param date_cols: datetime columns to process
+    :param holidays_separate: label Belgian holidays as 'holiday' instead of 'week'
     :return: annotated data frame
     """
 
     # Type check
     date_cols = date_cols if isinstance(date_cols, list) else [date_cols]
 
-    # Mapping dates to types of days
-    def label_date(date: dt.datetime, holidays_separate=holidays_separate) -> str:
-        # Get weekday, hour, minute and second
-        dt = date.date()
-        wd = date.weekday()
-
-        # Weekend?
-        if wd >= 5:
-            return "weekend"
-
-        # Holiday?
-        if dt in be_holidays and holidays_separate:
-            return "holiday"
-
-        # Else: regular weekday
-        return "week"
-
     # Loop over date columns
     for date_col in date_cols:
         # Make sure they're in the correct format
@@ -295,17 +503,36 @@ def add_date_annotation(df: pd.DataFrame, date_cols: list, holidays_separate=Fal
         # Get new name (subtract date, add day of the week)
         new_col = date_col[:-4] + 'DOTW'
 
-        # Process each row
-        tqdm.pandas(desc=f"Adding dotw <{date_col}>", position=0, leave=True)
-        df[new_col] = df[date_col].progress_apply(lambda row: label_date(row))
+        # Nothing to label
+        first, last = df[date_col].min(), df[date_col].max()
+        if pd.isna(first):
+            df[new_col] = pd.Categorical([np.nan] * len(df))
+            continue
+
+        # Get day types for the years spanned by the data
+        calendar = get_calendar(first_year=first.year, last_year=last.year, holidays_separate=holidays_separate)
+
+        # Position of each date in the calendar (missing dates get code -1)
+        days = df[date_col].to_numpy(dtype='datetime64[D]')
+        valid = ~np.isnat(days)
+        offsets = (days[valid] - np.datetime64(f'{first.year}-01-01', 'D')).astype('int64')
+        codes = np.full(len(days), -1, dtype='int8')
+        codes[valid] = calendar.cat.codes.to_numpy()[offsets]
+
+        # Join day types back onto the rows
+        df[new_col] = pd.Categorical.from_codes(codes=codes, categories=calendar.cat.categories)
 
     return df
 
 
-def add_time_of_day_annotation(df: pd.DataFrame, time_cols: list = ['startTime']):
+def add_time_of_day_annotation(df: pd.DataFrame, time_cols: list = ['startTime'], bins: list = None,
+                               labels: list = None):
     """
     Add time of day annotation depending on datetime field
     :param df: appevents dataframe
+    :param time_cols: datetime columns to process
+    :param bins: hour bin edges, right edge included (default: TIME_OF_DAY_BINS)
+    :param labels: labels for the bins (default: TIME_OF_DAY_LABELS)
     :return: annotated dataframe
     """
 
@@ -313,19 +540,8 @@ def add_time_of_day_annotation(df: pd.DataFrame, time_cols: list = ['startTime']
     time_cols = time_cols if isinstance(time_cols, list) else [time_cols]
 
     # Mapping hours to time zones
-    def label_hour(x):
-        if x <= 4:
-            return 'late_night'
-        elif x <= 8:
-            return 'early_morning'
-        elif x <= 12:
-            return 'morning'
-        elif x <= 16:
-            return 'noon'
-        elif x <= 20:
-            return 'eve'
-        else:
-            return 'night'
+    bins = TIME_OF_DAY_BINS if bins is None else bins
+    labels = TIME_OF_DAY_LABELS if labels is None else labels
 
     # Looping over time columns
     for time_col in time_cols:
@@ -338,9 +554,8 @@ def add_time_of_day_annotation(df: pd.DataFrame, time_cols: list = ['startTime']
         # Get new name (subtract date, add day of the week)
         new_col = time_col[:-4] + 'TOD'
 
-        # Process each row
-        tqdm.pandas(desc=f"Adding tod <{time_col}>", position=0, leave=True)
-        df[new_col] = hours.progress_apply(label_hour)
+        # Bin all hours at once
+        df[new_col] = pd.cut(hours, bins=bins, labels=labels, ordered=True)
 
     return df
 
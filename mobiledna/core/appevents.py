@@ -21,7 +21,8 @@ from tqdm import tqdm
 import mobiledna.core.help as hlp
 from mobiledna.core.annotate import add_category, add_appname, add_date_annotation, add_time_of_day_annotation, \
     add_age_from_surveyid
-from mobiledna.core.help import log, remove_first_and_last, longest_uninterrupted
+from mobiledna.core.help import log, remove_first_and_last, longest_uninterrupted, select_first_days
+from mobiledna.core.sequences import SessionSequences
 
 tqdm.pandas()
 
@@ -101,7 +102,8 @@ class Appevents:
         self.__session_sequences__ = self.get_session_sequences() if get_session_sequences else None
 
     @classmethod
-    def load_data(cls, path: str, file_type='infer', sep=',', decimal='.', bare=False, preprocess=False):
+    def load_data(cls, path: str, file_type='infer', sep=',', decimal='.', bare=False, preprocess=False,
+                  chunksize=None, users=None, date_range=None, applications=None, dtype_backend=None):
         """
         Construct Appevents object from path to data
 
@@ -110,13 +112,38 @@ class Appevents:
         :param sep: separator for csv files
         :param decimal: decimal for csv files
         :param bare: load only the most necessary columns for a more lightweight dataframe
+        :param chunksize: stream csv files in chunks of this many rows (lower peak memory)
+        :param users: only load these ids
+        :param date_range: only load this (first date, last date) range, edges included
+        :param applications: only load these applications
+        :param dtype_backend: 'pyarrow' to get Arrow-backed columns from parquet files
         :return: Appevents object
         """
 
-        data = hlp.load(path=path, index='appevents', file_type=file_type, sep=sep, dec=decimal, bare=bare)
+        data = hlp.load(path=path, index='appevents', file_type=file_type, sep=sep, dec=decimal, bare=bare,
+                        chunksize=chunksize, users=users, date_range=date_range, applications=applications,
+                        dtype_backend=dtype_backend)
 
         return cls(data=data, preprocess=preprocess)
 
+    @classmethod
+    def scan_data(cls, path: str, batch_size=1_000_000, users=None, date_range=None, applications=None):
+        """
+        Lazily wrap a Parquet file or dataset directory, without loading it (see LazyAppevents)
+
+        :param path: path to the file or dataset directory
+        :param batch_size: maximum number of rows held in memory at once
+        :param users: only scan these ids
+        :param date_range: only scan this (first date, last date) range, edges included
+        :param applications: only scan these applications
+        :return: LazyAppevents object
+        """
+
+        from mobiledna.core.lazy import LazyAppevents
+
+        return LazyAppevents(path=path, batch_size=batch_size, users=users, date_range=date_range,
+                             applications=applications)
+
     @classmethod
     def from_pickle(cls, path: str):
         """
@@ -131,7 +158,8 @@ class Appevents:
 
         return object
 
-    def save_data(self, dir: str, name: str, csv=False, pickle=False, parquet=True):
+    def save_data(self, dir: str, name: str, csv=False, pickle=False, parquet=True, partition_by=None,
+                  row_group_size=None, write_statistics=True):
         """
         Save data from Appevents object to data frame
         :param dir: directory to save
@@ -139,10 +167,14 @@ class Appevents:
         :param csv: csv format
         :param pickle: pickle format
         :param parquet: parquet format
+        :param partition_by: write parquet as a dataset partitioned by 'id', 'month' or both
+        :param row_group_size: maximum number of rows per parquet row group
+        :param write_statistics: store parquet column statistics
         :return: None
         """
 
-        hlp.save(df=self.__data__, dir=dir, name=name, csv_file=csv, pickle=pickle, parquet=parquet)
+        hlp.save(df=self.__data__, dir=dir, name=name, csv_file=csv, pickle=pickle, parquet=parquet,
+                 partition_by=partition_by, row_group_size=row_group_size, write_statistics=write_statistics)
 
     def to_pickle(self, path: str):
         """
@@ -223,28 +255,26 @@ class Appevents:
         else:
             return data
 
-    def strip(self, uninterrupted=None, number_of_days=None, min_log_days=None):
+    def strip(self, uninterrupted=None, number_of_days=None, min_log_days=None, n_jobs=1):
 
         if self.__stripped__:
             log('Already stripped this Appevents object!', lvl=1)
             return self
 
         # Cut off head and tail
-        tqdm.pandas(desc="Cutting off head and tail", position=0, leave=True)
-        self.__data__ = self.__data__.groupby('id').progress_apply(lambda df: remove_first_and_last(df=df)).reset_index(
-            drop=True)
+        self.__data__ = hlp.apply_by_id(df=self.__data__, func=remove_first_and_last, n_jobs=n_jobs, by_group=False,
+                                        desc="Cutting off head and tail", by='id').reset_index(drop=True)
 
         # Keep only the longest uninterrupted sequence:
         if uninterrupted:
             # Get longest uninterrupted sequence
-            tqdm.pandas(desc="Finding longest uninterrupted sequence", position=0, leave=True)
-            self.__data__ = self.__data__.groupby('id').progress_apply(
-                lambda df: longest_uninterrupted(df=df)).reset_index(
-                drop=True)
+            self.__data__ = hlp.apply_by_id(df=self.__data__, func=longest_uninterrupted, n_jobs=n_jobs,
+                                            by_group=False,
+                                            desc="Finding longest uninterrupted sequence").reset_index(drop=True)
 
         # If a number of days is set
         if number_of_days:
-            self.select_n_first_days(n=number_of_days, inplace=True)
+            self.select_n_first_days(n=number_of_days, inplace=True, n_jobs=n_jobs)
 
         # If a minimum number of log days is set
         if min_log_days:
@@ -272,24 +302,18 @@ class Appevents:
 
         return df
 
-    def select_n_first_days(self, n: int, inplace=False):
+    def select_n_first_days(self, n: int, inplace=False, n_jobs=1):
         """
         Select the first n days in the data frame, either inplace or on a copy that is returned.
 
         :param n: number of days
         :param inplace: modify object or return copy of data
+        :param n_jobs: number of processes to spread the ids over
         :return: modified Appevents object or modified copy of data frame
         """
 
-        def select_helper(data: pd.DataFrame, n: int):
-
-            start = data.startDate.min()
-            end = start + pd.Timedelta(n - 1, 'D')
-
-            return data.loc[(data.startDate >= start) & (data.startDate <= end)]
-
-        selection = self.__data__.groupby('id'). \
-            apply(lambda data: select_helper(data=data, n=n)).reset_index(drop=True)
+        selection = hlp.apply_by_id(df=self.__data__, func=select_first_days, n_jobs=n_jobs, by_group=False,
+                                    desc="Selecting first days", n=n, by='id').reset_index(drop=True)
 
         if inplace:
             self.__data__ = selection
@@ -306,11 +330,13 @@ class Appevents:
         :return: object or copy, depending on inplace parameter
         """
 
+        selection = hlp.impose_min_days(df=self.__data__, n=n)
+
         if inplace:
-            self.filter(users=list(self.get_days()[(self.get_days() >= n)].index), inplace=True)
+            self.__data__ = selection
             return self
         else:
-            return self.filter(users=list(self.get_days()[(self.get_days() >= n)].index), inplace=False)
+            return selection
 
     def merge(self, *appevents: pd.DataFrame):
         """
@@ -337,15 +363,15 @@ class Appevents:
 
         return self
 
-    def add_appname(self, scrape=False, overwrite=False):
+    def add_appname(self, scrape=False, overwrite=False, alias=False):
 
-        self.__data__ = add_appname(df=self.__data__, scrape=scrape, overwrite=overwrite)
+        self.__data__ = add_appname(df=self.__data__, scrape=scrape, overwrite=overwrite, alias=alias)
 
         return self
 
-    def add_time_of_day(self, time_col='startTime'):
+    def add_time_of_day(self, time_col='startTime', bins=None, labels=None):
 
-        self.__data__ = add_time_of_day_annotation(df=self.__data__, time_cols=time_col)
+        self.__data__ = add_time_of_day_annotation(df=self.__data__, time_cols=time_col, bins=bins, labels=labels)
 
         return self
 
@@ -421,35 +447,32 @@ class Appevents:
         """
         Returns the number of unique days
         """
-        return self.__data__.groupby('id').startDate.nunique().rename('days')
+        return self.__data__.groupby('id', observed=True).startDate.nunique().rename('days')
 
     def get_events(self) -> pd.Series:
         """
         Returns the number of appevents
         """
 
-        return self.__data__.groupby('id').application.count().rename('events')
+        return self.__data__.groupby('id', observed=True).application.count().rename('events')
 
     def get_durations(self) -> pd.Series:
         """
         Returns the total duration
         """
-        return self.__data__.groupby('id').duration.sum().rename('durations')
+        return self.__data__.groupby('id', observed=True).duration.sum().rename('durations')
 
-    def get_session_sequences(self) -> list:
-        """
-        Returns a list of all session sequences
+    def get_session_sequences(self, materialize=True):
         """
+        Returns all session sequences (applications in order of use), in order of first appearance
 
-        sessions = []
-
-        t_sessions = tqdm(self.__data__.session.unique())
-        t_sessions.set_description('Extracting sessions')
+        :param materialize: return a list of tuples, or a (ragged) SessionSequences object with integer app codes
+        :return: list of tuples or SessionSequences object
+        """
 
-        for session in t_sessions:
-            sessions.append(tuple(self.__data__.loc[self.__data__.session == session].application))
+        sequences = SessionSequences.from_frame(df=self.__data__)
 
-        return sessions
+        return sequences.to_tuples() if materialize else sequences
 
     # Compound getters #
     ####################
@@ -474,10 +497,10 @@ class Appevents:
 
         # Final grouping occurs here
         groupby_list = ['id', series_unit] if series_unit else ['id']
+        keys = groupby_list + ['startDate'] if 'startDate' not in groupby_list else groupby_list
 
-        return data.groupby(((groupby_list + [
-            'startDate']) if not 'startDate' in groupby_list else groupby_list)).application.count().reset_index(). \
-            groupby(groupby_list).application.mean().rename(name)
+        return data.groupby(keys, observed=True).application.count().reset_index(). \
+            groupby(groupby_list, observed=True).application.mean().rename(name)
 
     def get_daily_duration(self, category=None, application=None, from_push=None, day_types=None,
                            time_of_day=None, hour_limits=None, series_unit=None) -> pd.Series:
@@ -498,10 +521,10 @@ class Appevents:
 
         # Final grouping occurs here
         groupby_list = ['id', series_unit] if series_unit else ['id']
+        keys = groupby_list + ['startDate'] if 'startDate' not in groupby_list else groupby_list
 
-        return data.groupby(((groupby_list + [
-            'startDate']) if not 'startDate' in groupby_list else groupby_list)).duration.sum().reset_index(). \
-            groupby(groupby_list).duration.mean().rename(name)
+        return data.groupby(keys, observed=True).duration.sum().reset_index(). \
+            groupby(groupby_list, observed=True).duration.mean().rename(name)
 
     def get_daily_active_sessions(self, series_unit=None) -> pd.Series:
         """
@@ -514,10 +537,10 @@ class Appevents:
 
         # Final grouping occurs here
         groupby_list = ['id', series_unit] if series_unit else ['id']
+        keys = groupby_list + ['startDate'] if 'startDate' not in groupby_list else groupby_list
 
-        return data.groupby(((groupby_list + [
-            'startDate']) if not 'startDate' in groupby_list else groupby_list)).session.nunique().reset_index(). \
-            groupby(groupby_list).session.mean().rename(name)
+        return data.groupby(keys, observed=True).session.nunique().reset_index(). \
+            groupby(groupby_list, observed=True).session.mean().rename(name)
 
     def get_daily_events_sd(self, category=None, application=None, from_push=None, day_types=None,
                             time_of_day=None, series_unit=None) -> pd.Series:
@@ -538,10 +561,10 @@ class Appevents:
 
         # Final grouping occurs here
         groupby_list = ['id', series_unit] if series_unit else ['id']
+        keys = groupby_list + ['startDate'] if 'startDate' not in groupby_list else groupby_list
 
-        return data.groupby(((groupby_list + [
-            'startDate']) if not 'startDate' in groupby_list else groupby_list)).application.count().reset_index(). \
-            groupby(groupby_list).application.std().rename(name)
+        return data.groupby(keys, observed=True).application.count().reset_index(). \
+            groupby(groupby_list, observed=True).application.std().rename(name)
 
     def get_daily_duration_sd(self, category=None, application=None, from_push=None, day_types=None,
                               time_of_day=None, series_unit=None) -> pd.Series:
@@ -561,10 +584,10 @@ class Appevents:
                            time_of_day=time_of_day)
         # Final grouping occurs here
         groupby_list = ['id', series_unit] if series_unit else ['id']
+        keys = groupby_list + ['startDate'] if 'startDate' not in groupby_list else groupby_list
 
-        return data.groupby(((groupby_list + [
-            'startDate']) if not 'startDate' in groupby_list else groupby_list)).duration.sum().reset_index(). \
-            groupby(groupby_list).duration.std().rename(name)
+        return data.groupby(keys, observed=True).duration.sum().reset_index(). \
+            groupby(groupby_list, observed=True).duration.std().rename(name)
 
     def get_daily_active_sessions_sd(self, series_unit=None) -> pd.Series:
         """
@@ -577,10 +600,10 @@ class Appevents:
 
         # Final grouping occurs here
         groupby_list = ['id', series_unit] if series_unit else ['id']
+        keys = groupby_list + ['startDate'] if 'startDate' not in groupby_list else groupby_list
 
-        return data.groupby(((groupby_list + [
-            'startDate']) if not 'startDate' in groupby_list else groupby_list)).session.nunique().reset_index(). \
-            groupby(groupby_list).session.std().rename(name)
+        return data.groupby(keys, observed=True).session.nunique().reset_index(). \
+            groupby(groupby_list, observed=True).session.std().rename(name)
 
     def get_daily_number_of_apps(self, series_unit=None) -> pd.Series:
 
@@ -591,8 +614,8 @@ class Appevents:
         # Final grouping occurs here
         groupby_list = ['id', series_unit] if series_unit else ['id']
 
-        return data.groupby(groupby_list + ['startDate']).application.nunique().reset_index(). \
-            groupby(groupby_list).application.mean().rename(name)
+        return data.groupby(groupby_list + ['startDate'], observed=True).application.nunique().reset_index(). \
+            groupby(groupby_list, observed=True).application.mean().rename(name)
 
     def get_daily_number_of_apps_sd(self, series_unit=None) -> pd.Series:
 
@@ -601,10 +624,48 @@ class Appevents:
         data = self.__data__
 
         groupby_list = ['id', series_unit] if series_unit else ['id']
+        keys = groupby_list + ['startDate'] if 'startDate' not in groupby_list else groupby_list
+
+        return data.groupby(keys, observed=True).application.nunique().reset_index(). \
+            groupby(groupby_list, observed=True).application.std().rename(name)
+
+    def daily_profile(self, category=None, application=None, from_push=None, day_types=None, time_of_day=None,
+                      hour_limits=None, series_unit=None) -> pd.DataFrame:
+        """
+        Returns daily events, durations, active sessions and number of apps (mean and standard deviation over
+        days), computed in one grouped pass over the (filtered) data
+
+        :return: data frame with one row per id (and series unit), columns named after the daily getters
+        """
+
+        # Field name suffix
+        suffix = ((f'_{category}' if category else '') +
+                  (f'_{application}' if application else '') +
+                  (f'_{day_types}' if day_types else '') +
+                  (f'_{time_of_day}' if time_of_day else '')).lower()
+
+        # Filter data on request
+        data = self.filter(category=category, application=application, from_push=from_push, day_types=day_types,
+                           time_of_day=time_of_day, hour_limits=hour_limits)
+
+        # Final grouping occurs here
+        groupby_list = ['id', series_unit] if series_unit else ['id']
+        keys = groupby_list + ['startDate'] if 'startDate' not in groupby_list else groupby_list
+
+        # All daily aggregates at once
+        aggregates = {'daily_events': ('application', 'count'),
+                      'daily_durations': ('duration', 'sum'),
+                      'daily_active_sessions': ('session', 'nunique'),
+                      'daily_number_of_apps': ('application', 'nunique')}
+        aggregates = {name: agg for name, agg in aggregates.items() if agg[0] in data.columns}
+
+        daily = data.groupby(keys, observed=True).agg(**aggregates)
+
+        # Summarize over days
+        profile = daily.groupby(level=groupby_list, observed=True).agg(['mean', 'std'])
+        profile.columns = [name + ('_sd' if stat == 'std' else '') + suffix for name, stat in profile.columns]
 
-        return data.groupby(((groupby_list + [
-            'startDate']) if not 'startDate' in groupby_list else groupby_list)).application.nunique().reset_index(). \
-            groupby(groupby_list).application.std().rename(name)
+        return profile[[name + suffix for name in aggregates] + [name + '_sd' + suffix for name in aggregates]]
 
     def get_sessions_starting_with(self, category=None, application=None, normalize=False, series_unit=None):
 
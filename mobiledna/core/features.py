@@ -21,19 +21,214 @@ import mobiledna.core.help as hlp
 import pandas as pd
 import datetime as dt
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from inspect import signature
 from os.path import join
 
 # TODO:
 # - use Appevents functions for daily duration and appevents
 # - add function to add a date column into the annotate.py class
 
+### ### ### ### ###
+# Shared context  #
+### ### ### ### ###
+
+class FeatureContext:
+    """ Holds the input dataframes of a feature run, and computes intermediates that several
+        calculators need (logdays, sorted copies, session table, masks) once, on first use.
+    """
+
+    def __init__(self, df: pd.DataFrame, df_s: pd.DataFrame = None, df_n: pd.DataFrame = None):
+        self.df = df
+        self.df_s = df_s
+        self.df_n = df_n
+        self.__cache__ = {}
+
+    def _cached(self, key, compute):
+        if key not in self.__cache__:
+            self.__cache__[key] = compute()
+        return self.__cache__[key]
+
+    @property
+    def logdays(self) -> pd.Series:
+        """ Unique days someone used their smartphone """
+        return self._cached("logdays", lambda: self.df.groupby("id")["date"].nunique())
+
+    @property
+    def df_sorted(self) -> pd.DataFrame:
+        """ Appevents sorted by id and start time """
+        return self._cached("df_sorted", lambda: self.df.sort_values(by=["id", "startTime"]))
+
+    @property
+    def df_by_time(self) -> pd.DataFrame:
+        """ Appevents sorted by start time """
+        return self._cached("df_by_time", lambda: self.df.sort_values("startTime", ascending=True))
+
+    @property
+    def df_n_by_time(self) -> pd.DataFrame:
+        """ Notifications sorted by time """
+        return self._cached("df_n_by_time", lambda: self.df_n.sort_values("time", ascending=True))
+
+    @property
+    def session_start_stop(self) -> pd.DataFrame:
+        """ First row of every session (from the sorted appevents), with the start of the next session """
+
+        def compute():
+            session_start_stop = self.df_sorted.groupby(["id", "session"]).head(1)[
+                ["id", "session", "date", "startTime", "endTime"]
+            ]
+            return session_start_stop.assign(
+                start_next=session_start_stop.groupby(["id"])["startTime"].shift(-1)
+            )
+
+        return self._cached("session_start_stop", compute)
+
+    @property
+    def app_groups(self) -> dict:
+        """ Predefined app groups for the category measures """
+        return self._cached("app_groups", get_app_groups)
+
+    def mask(self, df: pd.DataFrame, column: str, values: list) -> pd.Series:
+        """ Boolean mask on df: rows where column is in values (only cached if df is the context's appevents,
+            so a mask is never aligned on a different frame)
+        """
+        if df is not self.df:
+            return df[column].isin(values)
+        return self._cached(("mask", column, tuple(values)), lambda: self.df[column].isin(values))
+
+
+def get_context(ctx: FeatureContext, df: pd.DataFrame, df_s: pd.DataFrame = None,
+                df_n: pd.DataFrame = None) -> FeatureContext:
+    """ Returns the given context, or a new one for these dataframes """
+    return ctx if ctx is not None else FeatureContext(df=df, df_s=df_s, df_n=df_n)
+
+
+### ### ### ### ###
+# Feature registry #
+### ### ### ### ###
+
+# Registered calculators: {calculator name: {"func", "columns", "inputs", "intermediates", "uses_ctx"}}
+FEATURE_REGISTRY = {}
+
+# Order in which context intermediates are computed (later ones build on earlier ones)
+INTERMEDIATES = ["df_sorted", "df_by_time", "df_n_by_time", "logdays", "session_start_stop", "app_groups"]
+
+# App groups of the category measures (see get_app_groups)
+APP_GROUPS = ["entertainment", "productivity", "email", "sms", "whatsapp", "messenger", "communication"]
+
+# Apps for the memory features
+SEARCH_APPS = [
+    "com.google.android.googlequicksearchbox"
+]
+NOTES_APPS = [
+    "com.microsoft.office.onenote",
+    "com.zoho.notebook",
+    "com.splendapps.adler",
+    "com.evernote",
+    "com.yocto.wenote",
+    "com.google.android.keep",
+    "org.whiteglow.keepmynotes",
+    "com.dencreak.esmemo"
+]
+
+
+def register(*columns: str, inputs=("df",), intermediates=()):
+    """ Decorator that registers a feature calculator.
+
+    :param columns: feature (column) names the calculator returns
+    :param inputs: dataframes the calculator takes ("df", "df_s", "df_n")
+    :param intermediates: shared context intermediates the calculator uses (see FeatureContext)
+    :return: decorator (the calculator itself is left untouched)
+    """
+
+    def decorator(func):
+        FEATURE_REGISTRY[func.__name__] = {
+            "func": func,
+            "columns": list(columns),
+            "inputs": tuple(inputs),
+            "intermediates": tuple(intermediates),
+            "uses_ctx": "ctx" in signature(func).parameters,
+        }
+        return func
+
+    return decorator
+
+
+def get_feature_names(inputs=("df", "df_s", "df_n")) -> list:
+    """ Returns the names of all registered features that can be computed from the given inputs """
+    return [column for spec in FEATURE_REGISTRY.values() if set(spec["inputs"]) <= set(inputs)
+            for column in spec["columns"]]
+
+
+def calc_features(df: pd.DataFrame, df_s: pd.DataFrame = None, df_n: pd.DataFrame = None, features: list = None,
+                  n_jobs=1) -> pd.DataFrame:
+    """
+    Computes registered features. Only the calculators that produce the requested features run, the shared
+    intermediates they declare are computed once (up front), and independent calculators run in parallel threads.
+
+    :param df: an Appevents DataFrame
+    :param df_s: a Sessions DataFrame
+    :param df_n: a Notifications DataFrame
+    :param features: feature names to compute (default: all features the given inputs allow)
+    :param n_jobs: number of threads
+    :return: a results DataFrame, indexed by id
+    """
+
+    available = [name for name, data in (("df", df), ("df_s", df_s), ("df_n", df_n)) if data is not None]
+    features = get_feature_names(inputs=available) if features is None else list(features)
+
+    # Find the calculators we need
+    owners = {column: name for name, spec in FEATURE_REGISTRY.items() for column in spec["columns"]}
+    unknown = [feature for feature in features if feature not in owners]
+    if unknown:
+        raise Exception(f"ERROR: Unknown features {unknown}!")
+
+    calculators = list(dict.fromkeys(owners[feature] for feature in features))
+    for name in calculators:
+        missing = set(FEATURE_REGISTRY[name]["inputs"]) - set(available)
+        if missing:
+            raise Exception(f"ERROR: {name} needs {sorted(missing)}!")
+
+    # Shared intermediates, computed once
+    ctx = FeatureContext(df=df, df_s=df_s, df_n=df_n)
+    needed = {intermediate for name in calculators for intermediate in FEATURE_REGISTRY[name]["intermediates"]}
+    for intermediate in INTERMEDIATES:
+        if intermediate in needed:
+            getattr(ctx, intermediate)
+
+    # Preallocated result frame (one row per id)
+    result = pd.DataFrame(np.nan, index=ctx.logdays.index, columns=features)
+
+    def run(name):
+        spec = FEATURE_REGISTRY[name]
+        kwargs = {data: getattr(ctx, data) for data in spec["inputs"]}
+        if spec["uses_ctx"]:
+            kwargs["ctx"] = ctx
+        out = spec["func"](**kwargs)
+        if isinstance(out, pd.Series):
+            out = out.to_frame()
+        return out.set_index("id") if "id" in out.columns else out
+
+    with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+        futures = {executor.submit(run, name): name for name in calculators}
+        for future in as_completed(futures):
+            out = future.result()
+            columns = [column for column in FEATURE_REGISTRY[futures[future]]["columns"] if column in features]
+            result[columns] = out.reindex(result.index)[columns].astype(float)
+
+    return result
+
+
 ### ### ### #
 # Anhedonia #
 ### ### ### #
-def features_calc_anhedonia(df: pd.DataFrame) -> pd.DataFrame:
+@register("daily_appevents", "daily_duration", "socmed_daily_appevents", "socmed_daily_notification_taps",
+          "socmed_daily_duration", "calls_daily_appevents", "calls_daily_duration", intermediates=("logdays",))
+def features_calc_anhedonia(df: pd.DataFrame, ctx: FeatureContext = None) -> pd.DataFrame:
     """ Takes an appevents dataframe and calculates all Anhedonia variables:
     """
-    logdays = df.groupby("id")["date"].nunique()
+    ctx = get_context(ctx, df)
+    logdays = ctx.logdays
     # logdays = ae.get_days()
 
     ## less smartphone use
@@ -51,7 +246,7 @@ def features_calc_anhedonia(df: pd.DataFrame) -> pd.DataFrame:
 
     ## Losing interest in social media
     # filter on social media apps
-    mask = df["category"].isin(["social"])
+    mask = ctx.mask(df, "category", ["social"])
 
     # average daily tapped notifications
     socmed_daily_notification_taps = (
@@ -65,7 +260,7 @@ def features_calc_anhedonia(df: pd.DataFrame) -> pd.DataFrame:
     socmed_daily_duration = (df[mask].groupby("id")["duration"].sum() / logdays).rename("socmed_daily_duration")
 
     ## less incoming and outgoing calls
-    mask = df["category"].isin(["calling"])
+    mask = ctx.mask(df, "category", ["calling"])
     calls_daily_appevents = (df[mask].groupby("id")["application"].count() / logdays).rename("calls_daily_appevents")
     calls_daily_duration = (df[mask].groupby("id")["duration"].sum() / logdays).rename("calls_daily_duration")
 
@@ -94,47 +289,13 @@ def features_calc_anhedonia(df: pd.DataFrame) -> pd.DataFrame:
 ### ### ### ### ### ###
 # Executive functions #
 ### ### ### ### ### ###
-def calc_app_cat_use(df: pd.DataFrame, appdict: dict) -> pd.DataFrame:
-    """ Takes a dataframe and a dictionary consisting of {category_name: list_of_apps} and calculates
-        average daily appevents and duration for provided category.
-        Returns a new dataframe with these aggregated measures.
-    """
-
-    # Loops over the dictionary, k(ey) is the name of the category,
-    # v(alue) the list of apps belonging to the category
-    for k, v in appdict.items():
-        cat_name = k
-        category = v
-
-    # filter for the dataframe, only relevant apps
-    mask = df["application"].isin(category)
-
-    logdays = df.groupby("id")["date"].nunique()
-
-    # average daily appevents and duration for the category
-    daily_appevents = (df[mask].groupby("id")["application"].count() / logdays).rename(f"{cat_name}_daily_appevents")
-    daily_duration = (df[mask].groupby("id")["duration"].sum() / logdays).rename(f"{cat_name}_daily_duration")
-
-    result = pd.merge(
-        daily_appevents,
-        daily_duration,
-        left_index=True,
-        right_index=True,
-        how="left"
-    )
-
-    return result
-
-def calc_category_measures(df: pd.DataFrame) -> pd.DataFrame:
-    """ Takes a dataframe, and a predefined list of app categories, loops over these categories
-        and merges the aggregated measures into a new dataframe.
+def get_app_groups() -> dict:
+    """ Returns the predefined app groups for the category measures, as {group_name: list_of_apps}.
+        An app can belong to multiple groups.
     """
     # DF with app names and app categories
     # appcat = pd.read_excel("../data/app_categories.xlsx")
-    meta = np.load(join(hlp.CACHE_DIR, 'app_meta.npy'), allow_pickle=True).item()
-    appcat = pd.DataFrame.from_dict(meta, orient="index")[["fancyname", "genre", "genre_old"]]
-    appcat.reset_index(inplace=True)
-    appcat.rename({"index": "app"}, axis=1, inplace=True)
+    appcat = hlp.get_meta_frame()[["genre"]].rename_axis("app").reset_index()
 
     # Creating the different category dictionaries
     entertainment = list(appcat[appcat["genre"] == "entertainment"]["app"])
@@ -183,23 +344,67 @@ def calc_category_measures(df: pd.DataFrame) -> pd.DataFrame:
     ]
     communication_dict = {"communication": communication}
 
-    # creates a list of dictionaries to loop over
-    dict_list = [entertainment_dict, productivity_dict, email_dict, sms_dict, whatsapp_dict, messenger_dict,
-                 communication_dict]
+    # combine the dictionaries, in order
+    app_groups = {}
+    for group_dict in [entertainment_dict, productivity_dict, email_dict, sms_dict, whatsapp_dict, messenger_dict,
+                       communication_dict]:
+        app_groups.update(group_dict)
 
-    # takes a "starting" dataframe, with one ID per row to add the variables to
-    app_category_use = df[["id"]].drop_duplicates()
+    return app_groups
 
-    # loop over the list of dictionaries, calculates the variables and add them to the starting dataframe
-    for appcat in dict_list:
-        app_category_use = pd.merge(
-            app_category_use,
-            calc_app_cat_use(df, appcat),
-            on="id"
-        )
 
-    return app_category_use
+def calc_app_group_use(df: pd.DataFrame, app_groups: dict, ctx: FeatureContext = None) -> pd.DataFrame:
+    """ Takes a dataframe and a dictionary consisting of {group_name: list_of_apps} and calculates
+        average daily appevents and duration for every group in one pass.
+        Returns a wide dataframe with one row per ID (in order of appearance).
+        Groups an ID never used are NaN, or 0 if IDs are categorical (like a groupby on categorical IDs gives).
+    """
+
+    # membership table: one row per (app, group) pair
+    membership = pd.DataFrame(
+        [(app, group) for group, apps in app_groups.items() for app in dict.fromkeys(apps)],
+        columns=["application", "group"],
+    )
+
+    # pre-aggregate per (id, app), so the join only touches used apps
+    per_app = df.groupby(["id", "application"], observed=True).agg(
+        appevents=("application", "count"), duration=("duration", "sum")
+    ).reset_index()
+    per_app["application"] = per_app["application"].astype(str)
+
+    # sum over the apps of each group
+    per_group = per_app.merge(membership, on="application").groupby(["id", "group"], observed=True)[
+        ["appevents", "duration"]].sum()
+
+    # average daily measures (logdays only once)
+    per_group = per_group.div(get_context(ctx, df).logdays, axis=0, level="id")
+
+    # wide frame: {group}_daily_appevents, {group}_daily_duration per group
+    wide = per_group.unstack("group")
+    result = df[["id"]].drop_duplicates().reset_index(drop=True)
+    for group in app_groups:
+        for measure in ["appevents", "duration"]:
+            values = wide[(measure, group)] if (measure, group) in wide.columns else pd.Series(dtype=float)
+            result[f"{group}_daily_{measure}"] = result["id"].map(values).astype(float)
+
+    if isinstance(df["id"].dtype, pd.CategoricalDtype):
+        result = result.fillna(0)
 
+    return result
+
+
+@register(*[f"{group}_daily_{measure}" for group in APP_GROUPS for measure in ["appevents", "duration"]],
+          intermediates=("logdays", "app_groups"))
+def calc_category_measures(df: pd.DataFrame, ctx: FeatureContext = None) -> pd.DataFrame:
+    """ Takes a dataframe, and a predefined list of app categories, and calculates
+        the aggregated measures of all categories in a single scan.
+    """
+    ctx = get_context(ctx, df)
+
+    return calc_app_group_use(df, ctx.app_groups, ctx=ctx)
+
+
+@register("0s-30s", "30s-1m", "1m-5m", "+5m")
 def calc_scatter(df: pd.DataFrame) -> pd.DataFrame:
     """ Takes a dataframe and returns a new one with average amount of daily session duration binned in four categories
     """
@@ -221,16 +426,13 @@ def calc_scatter(df: pd.DataFrame) -> pd.DataFrame:
 
     return scatter_pivot
 
-def calc_session_lapse(df: pd.DataFrame) -> pd.DataFrame:
+@register("avg_lapse_duration", intermediates=("session_start_stop",))
+def calc_session_lapse(df: pd.DataFrame, ctx: FeatureContext = None) -> pd.DataFrame:
     """ Takes a dataframe and calculates the average time between sessions.
     """
 
-    # Groups the dataframe and takes the first row [head(1)] of each groupby(["id", "session"])
-    # important to have a SORTED dataframe!
-    session_start_stop = df.groupby(["id", "session"]).head(1)[["id", "session", "date", "startTime", "endTime"]]
-
-    # add the start moment of session+1 as a new variable for the existing session
-    session_start_stop = session_start_stop.assign(start_next=session_start_stop.groupby(["id"])["startTime"].shift(-1))
+    # First row of each session (on the SORTED dataframe), with the start moment of session+1
+    session_start_stop = get_context(ctx, df).session_start_stop
 
     # adds the duration variable, calculates the time between the end of session and start of session+1
     session_start_stop = session_start_stop.assign(
@@ -244,29 +446,24 @@ def calc_session_lapse(df: pd.DataFrame) -> pd.DataFrame:
     return avg_session_lapse
 
 # TODO: filter notifications
-def calc_average_notif_between(df: pd.DataFrame, df_n: pd.DataFrame):
+@register("mean_notif_between", inputs=("df", "df_n"), intermediates=("session_start_stop", "df_n_by_time"))
+def calc_average_notif_between(df: pd.DataFrame, df_n: pd.DataFrame, ctx: FeatureContext = None):
     """ Takes an appevents and notifications dataframe and calculates the average amount of received notifications between two app sessions, per person.
     """
+    ctx = get_context(ctx, df, df_n=df_n)
 
-    # Groups the dataframe and takes the first row [head(1)] of each groupby(["id", "session"])
-    # important to have a SORTED dataframe!
-    session_start_stop = df.groupby(["id", "session"]).head(1)[
-        ["id", "session", "date", "startTime", "endTime"]
-    ]
-
-    # add the start moment of session+1 as a new variable for the existing session
-    session_start_stop = session_start_stop.assign(
-        start_next=session_start_stop.groupby(["id"])["startTime"].shift(-1)
-    )
+    # First row of each session (on the SORTED dataframe), with the start moment of session+1
+    session_start_stop = ctx.session_start_stop
 
     # add filter to keep only "relevant" notifications
+    df_n = ctx.df_n_by_time
     mask = df_n["ongoing"] == False
     mask &= df_n["priority"] >= 0
     df_n = df_n[mask]
 
     # merge notifications dataframe with sessions overview, find "last" session per notification
     notif_session = pd.merge_asof(
-        df_n.sort_values("time"),
+        df_n,
         session_start_stop[
             ["startTime", "endTime", "start_next", "session", "id"]
         ].sort_values("startTime"),
@@ -297,20 +494,23 @@ def calc_average_notif_between(df: pd.DataFrame, df_n: pd.DataFrame):
     return mean_notifications_between.rename("mean_notif_between")
 
 # TODO: use notifications function
+@register("avg_daily_notifications", inputs=("df_n",))
 def calc_avg_daily_notifications(df_n: pd.DataFrame):
     total_days = df_n.groupby("id")["date"].nunique()
     notifs_pd = df_n.groupby("id")["application"].count() / total_days
 
     return notifs_pd.rename("avg_daily_notifications")
 
-def calc_reaction_time(df: pd.DataFrame, df_n: pd.DataFrame):
+@register("avg_reaction_time", inputs=("df", "df_n"), intermediates=("df_by_time", "df_n_by_time"))
+def calc_reaction_time(df: pd.DataFrame, df_n: pd.DataFrame, ctx: FeatureContext = None):
     """ Takes an appevents and notifications dataframe and
         calculates the average reaction time (in s) between receiving a notification and opening the application.
     """
+    ctx = get_context(ctx, df, df_n=df_n)
 
     # Filter DF's to merge
-    df = df.sort_values("startTime", ascending=True)
-    df_n = df_n.sort_values("time", ascending=True)
+    df = ctx.df_by_time
+    df_n = ctx.df_n_by_time
 
     # merge_asof to find closest match
     notif_merge = pd.merge_asof(
@@ -333,15 +533,13 @@ def calc_reaction_time(df: pd.DataFrame, df_n: pd.DataFrame):
 
     return mean_reaction_s.rename("avg_reaction_time")
 
-def features_calc_executive_function(df: pd.DataFrame, df_n: pd.DataFrame) -> pd.DataFrame:
-    """ Takes an Appevents and Notifications DataFrame and calculates all executive function variables.
+@register("apps_per_session", "unique_apps_per_session", "daily_active_sessions", "avg_app_duration",
+          intermediates=("logdays",))
+def calc_session_measures(df: pd.DataFrame, ctx: FeatureContext = None) -> pd.DataFrame:
+    """ Takes an appevents dataframe and calculates apps per session, daily active sessions and average appevent
+        duration.
     """
-
-    # Sort dataframe, important for session lapses
-    df = df.sort_values(by=["id", "startTime"])
-
-    # Unique days someone used their smartphone
-    logdays = df.groupby("id")["date"].nunique()
+    logdays = get_context(ctx, df).logdays
 
     # Average amount of apps per session
     apps_per_session = df.groupby(["id", "session"])["application"].count().groupby("id").mean().rename(
@@ -354,26 +552,45 @@ def features_calc_executive_function(df: pd.DataFrame, df_n: pd.DataFrame) -> pd
     # Average amount of daily _active_ sessions (so sessions with apps)
     daily_sessions = (df.groupby(["id"])["session"].nunique() / logdays).rename("daily_active_sessions")
 
+    # Average amount of time spent on one appevent
+    avg_app_duration = df.groupby(["id", "date"])["duration"].mean().groupby("id").mean().rename("avg_app_duration")
+
+    return pd.concat([apps_per_session, unique_apps_per_session, daily_sessions, avg_app_duration], axis=1)
+
+def features_calc_executive_function(df: pd.DataFrame, df_n: pd.DataFrame, ctx: FeatureContext = None) -> pd.DataFrame:
+    """ Takes an Appevents and Notifications DataFrame and calculates all executive function variables.
+    """
+    ctx = get_context(ctx, df, df_n=df_n)
+
+    # Sort dataframe, important for session lapses
+    df = ctx.df_sorted
+
+    # Apps per session, daily active sessions and time spent on one appevent
+    session_measures = calc_session_measures(df, ctx=ctx)
+    apps_per_session = session_measures["apps_per_session"]
+    unique_apps_per_session = session_measures["unique_apps_per_session"]
+    daily_sessions = session_measures["daily_active_sessions"]
+
     # Duration and frequency per app category
-    category_measures = calc_category_measures(df)
+    category_measures = calc_category_measures(df, ctx=ctx)
 
     # Distribution of app sessions based on duration
     scatter_sessions = calc_scatter(df)
 
     # Average amount of time spent on one appevent
-    avg_app_duration = df.groupby(["id", "date"])["duration"].mean().groupby("id").mean().rename("avg_app_duration")
+    avg_app_duration = session_measures["avg_app_duration"]
 
     # Average amount of time between sessions
-    avg_lapse_duration = calc_session_lapse(df)
+    avg_lapse_duration = calc_session_lapse(df, ctx=ctx)
 
     # Average daily notifications
     avg_daily_notifications = calc_avg_daily_notifications(df_n)
 
     # Average amount of notifications between two sessions
-    avg_notifications_between = calc_average_notif_between(df=df, df_n=df_n)
+    avg_notifications_between = calc_average_notif_between(df=df, df_n=df_n, ctx=ctx)
 
     # Average notification reaction speed
-    avg_notification_reaction = calc_reaction_time(df=df, df_n=df_n)
+    avg_notification_reaction = calc_reaction_time(df=df, df_n=df_n, ctx=ctx)
 
     # Merge variables to new dataframe
     result = pd.merge(
@@ -421,36 +638,55 @@ def features_calc_executive_function(df: pd.DataFrame, df_n: pd.DataFrame) -> pd
 # Memory  #
 ### ### ###
 
-def calc_daily_appevents(df: pd.DataFrame, apps: list) -> pd.DataFrame:
+def calc_daily_appevents(df: pd.DataFrame, apps: list, ctx: FeatureContext = None) -> pd.DataFrame:
     """
 
     :param df: appevents DataFrame
     :param apps: list of apps to filter on
+    :param ctx: shared feature context
     :return: results DataFrame with daily appevents for the selected app(s)
     """
-    logdays = df.groupby("id")["date"].nunique()
-    mask = df["application"].isin(apps)
+    ctx = get_context(ctx, df)
+    logdays = ctx.logdays
+    mask = ctx.mask(df, "application", apps)
 
     # Need to manually rename series afterwards
     avg_daily_appevents = (df[mask].groupby(["id"])["application"].count() / logdays).rename("avg_daily_appevents")
 
     return avg_daily_appevents
 
-def calc_daily_app_duration(df: pd.DataFrame, apps: list) -> pd.DataFrame:
+def calc_daily_app_duration(df: pd.DataFrame, apps: list, ctx: FeatureContext = None) -> pd.DataFrame:
     """
 
     :param df: appevents DataFrame
     :param apps: list of apps to filter on
+    :param ctx: shared feature context
     :return: results DataFrame with daily duration for the selected app(s)
     """
-    logdays = df.groupby("id")["date"].nunique()
-    mask = df["application"].isin(apps)
+    ctx = get_context(ctx, df)
+    logdays = ctx.logdays
+    mask = ctx.mask(df, "application", apps)
 
     # Need to manually rename series afterwards
     avg_daily_app_duration = (df[mask].groupby(["id"])["duration"].sum() / logdays).rename("avg_daily_app_duration")
 
     return avg_daily_app_duration
 
+@register("avg_daily_search", "avg_daily_search_duration", "avg_daily_notes", "avg_daily_notes_duration",
+          intermediates=("logdays",))
+def calc_search_and_notes_use(df: pd.DataFrame, ctx: FeatureContext = None) -> pd.DataFrame:
+    """ Takes an appevents dataframe and calculates daily appevents and duration for search and notes apps.
+    """
+    ctx = get_context(ctx, df)
+
+    return pd.concat([
+        calc_daily_appevents(df=df, apps=SEARCH_APPS, ctx=ctx).rename("avg_daily_search"),
+        calc_daily_app_duration(df=df, apps=SEARCH_APPS, ctx=ctx).rename("avg_daily_search_duration"),
+        calc_daily_appevents(df=df, apps=NOTES_APPS, ctx=ctx).rename("avg_daily_notes"),
+        calc_daily_app_duration(df=df, apps=NOTES_APPS, ctx=ctx).rename("avg_daily_notes_duration"),
+    ], axis=1)
+
+@register("sessions_empty_pct", inputs=("df", "df_s"))
 def calc_empty_sessions(df: pd.DataFrame, df_s: pd.DataFrame):
     """ Takes an appevents and sessions dataframe and calculates the percentage of _empty_ sessions.
     """
@@ -462,15 +698,16 @@ def calc_empty_sessions(df: pd.DataFrame, df_s: pd.DataFrame):
 
     return pct_empty.rename("sessions_empty_pct")
 
-def calc_app_reopen_same_session(df: pd.DataFrame) -> pd.DataFrame:
+@register("mean_same_app_s", "std_same_app_s", "median_same_app_s", intermediates=("df_sorted",))
+def calc_app_reopen_same_session(df: pd.DataFrame, ctx: FeatureContext = None) -> pd.DataFrame:
     """
     Calculates the time (in seconds) until a same application is opened again, in the same session.
     :param df: appevents DataFrame
+    :param ctx: shared feature context
     :return: results DataFrame
     """
-    data = df[["id", "session", "application", "startTime", "endTime", "duration"]]
-    data = data.sort_values(by=["id", "startTime"])
-    data.reset_index(drop=True, inplace=True)
+    data = get_context(ctx, df).df_sorted[["id", "session", "application", "startTime", "endTime", "duration"]]
+    data = data.reset_index(drop=True)
 
     ae_session_overview = (
             data.groupby(["id", "session"])["application"].value_counts() > 1
@@ -515,38 +752,27 @@ def calc_app_reopen_same_session(df: pd.DataFrame) -> pd.DataFrame:
 
     return res
 
-def features_calc_memory(df: pd.DataFrame, df_s: pd.DataFrame) -> pd.DataFrame:
+def features_calc_memory(df: pd.DataFrame, df_s: pd.DataFrame, ctx: FeatureContext = None) -> pd.DataFrame:
     """
     Calculates all memory features and returns a results DataFrame.
     :param df: appevents DataFrame
     :param df_s: sessions DataFrame
+    :param ctx: shared feature context
     :return: results DataFrame with all memory features calculated
     """
+    ctx = get_context(ctx, df, df_s=df_s)
 
-    search = [
-        "com.google.android.googlequicksearchbox"
-    ]
+    avg_daily_search = calc_daily_appevents(df=df, apps=SEARCH_APPS, ctx=ctx).rename("avg_daily_search")
+    avg_daily_search_duration = calc_daily_app_duration(df=df, apps=SEARCH_APPS, ctx=ctx).rename(
+        "avg_daily_search_duration")
 
-    avg_daily_search = calc_daily_appevents(df=df, apps=search).rename("avg_daily_search")
-    avg_daily_search_duration = calc_daily_app_duration(df=df, apps=search).rename("avg_daily_search_duration")
-
-    notes = [
-        "com.microsoft.office.onenote",
-        "com.zoho.notebook",
-        "com.splendapps.adler",
-        "com.evernote",
-        "com.yocto.wenote",
-        "com.google.android.keep",
-        "org.whiteglow.keepmynotes",
-        "com.dencreak.esmemo"
-    ]
-
-    avg_daily_notes = calc_daily_appevents(df=df, apps=notes).rename("avg_daily_notes")
-    avg_daily_notes_duration = calc_daily_app_duration(df=df, apps=notes).rename("avg_daily_notes_duration")
+    avg_daily_notes = calc_daily_appevents(df=df, apps=NOTES_APPS, ctx=ctx).rename("avg_daily_notes")
+    avg_daily_notes_duration = calc_daily_app_duration(df=df, apps=NOTES_APPS, ctx=ctx).rename(
+        "avg_daily_notes_duration")
 
     empty_sessions = calc_empty_sessions(df=df, df_s=df_s)
 
-    app_reopen_s = calc_app_reopen_same_session(df=df)
+    app_reopen_s = calc_app_reopen_same_session(df=df, ctx=ctx)
 
     res = pd.merge(
         avg_daily_search,
@@ -578,6 +804,34 @@ def features_calc_memory(df: pd.DataFrame, df_s: pd.DataFrame) -> pd.DataFrame:
 # Sleep  #
 ### ### ##
 
+def get_window_hours(start=dt.time(0, 0, 0), end=dt.time(7, 0, 0)) -> np.ndarray:
+    """ Returns a boolean array over the 24 hours of the day: True for hourly bins starting in [start, end) """
+    return np.array([start <= dt.time(hour) < end for hour in range(24)])
+
+def count_window_hours(first: pd.Series, last: pd.Series, start=dt.time(0, 0, 0), end=dt.time(7, 0, 0)) -> pd.Series:
+    """
+    Counts the hourly bins between first and last (floored to the hour, both included) that start in [start, end),
+    i.e. the bins a resample('1H') from first to last would keep after filtering on time - without building them.
+    :param first: first timestamp per id
+    :param last: last timestamp per id
+    :param start: start of the window
+    :param end: end of the window
+    :return: number of eligible hours per id
+    """
+    window_hours = get_window_hours(start=start, end=end)
+
+    # Cumulative count of eligible hours over two days, to count the hours in a partial day from any hour on
+    cumulative = np.concatenate([[0], np.cumsum(np.tile(window_hours, 2))])
+
+    first = first.dt.floor("H")
+    n_hours = ((last.dt.floor("H") - first) // pd.Timedelta(hours=1)).values.astype(int) + 1
+    first_hour = first.dt.hour.values
+    remainder = n_hours % 24
+
+    return pd.Series((n_hours // 24) * window_hours.sum() + cumulative[first_hour + remainder] -
+                     cumulative[first_hour], index=first.index)
+
+@register("sleep_avg_apps_per_hour", "sleep_avg_duration_per_hour_s")
 def calc_use_during_sleep(
         df: pd.DataFrame, start=dt.time(0, 0, 0), end=dt.time(7, 0, 0)
 ) -> pd.DataFrame:
@@ -585,23 +839,20 @@ def calc_use_during_sleep(
         standard hours: between 00:00:00 and 7:00:00
     """
 
-    # resample data per hour
-    df_per_hour = (
-        df.set_index("startTime")
-            .groupby("id")
-            .resample("1H")["duration"]
-            .agg(["count", "sum"])
-            .rename({"count": "apps", "sum": "duration"}, axis=1)
-            .reset_index()
-    )
+    # count and duration of appevents in the hourly bins of the window (only bins with events)
+    in_window = get_window_hours(start=start, end=end)[df["startTime"].dt.hour.values]
+    per_id = df[in_window].groupby("id", observed=True)["duration"].agg(["count", "sum"])
 
-    # filter based on time
-    mask = df_per_hour["startTime"].dt.time >= start
-    mask &= df_per_hour["startTime"].dt.time < end
+    # number of hourly bins in the window between each person's first and last appevent (empty ones included,
+    # ids without appevents left out)
+    span = df.groupby("id", observed=True)["startTime"].agg(["min", "max"])
+    hours = count_window_hours(first=span["min"], last=span["max"], start=start, end=end)
+    hours = hours[hours > 0]
 
-    # calculate averages per person based on filtered dataframe
-    avg_apps_per_hour = df_per_hour[mask].groupby(["id"])["apps"].mean()
-    avg_duration_per_hour = df_per_hour[mask].groupby(["id"])["duration"].mean()
+    # calculate averages per person over these bins
+    per_id = per_id.reindex(hours.index, fill_value=0)
+    avg_apps_per_hour = per_id["count"] / hours
+    avg_duration_per_hour = per_id["sum"] / hours
 
     # merge results
     res = pd.merge(
@@ -612,6 +863,8 @@ def calc_use_during_sleep(
 
     return res
 
+@register("sleep_start_mean", "sleep_start_median", "sleep_start_std", "sleep_stop_mean", "sleep_stop_median",
+          "sleep_stop_std")
 def calc_sleep_pattern(df: pd.DataFrame):
     """
     Takes an appevents dataframe and calculates descriptives on "stop time" and "start time".
@@ -691,9 +944,13 @@ def features_calc_all(df: pd.DataFrame, df_s: pd.DataFrame, df_n: pd.DataFrame)
     :param df_n: a Notifications DataFrame
     :return: a results DataFrame
     """
-    anhedonia_features = features_calc_anhedonia(df=df)
-    executive_features = features_calc_executive_function(df=df, df_n=df_n)
-    memory_features = features_calc_memory(df=df, df_s=df_s)
+
+    # Shared intermediates, computed once
+    ctx = FeatureContext(df=df, df_s=df_s, df_n=df_n)
+
+    anhedonia_features = features_calc_anhedonia(df=df, ctx=ctx)
+    executive_features = features_calc_executive_function(df=df, df_n=df_n, ctx=ctx)
+    memory_features = features_calc_memory(df=df, df_s=df_s, ctx=ctx)
     sleep_features = features_calc_sleep(df=df)
 
     all_features = pd.merge(
@@ -13,18 +13,24 @@ HELPER FUNCTIONS
 -- mailto:Wouter.Durnez@UGent.be
 """
 
+import json
 import os
 import random as rnd
 import sys
 import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
 from pprint import PrettyPrinter
+from collections.abc import Mapping
 from typing import Callable
 
 import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 from termcolor import colored
+from tqdm import tqdm
 
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -39,6 +45,7 @@ pp = PrettyPrinter(indent=4)
 LOG_LEVEL = 3
 DATA_DIR = os.path.join(os.pardir, os.pardir, 'data')
 CACHE_DIR = os.path.join(os.curdir, 'cache')
+META_FILE = 'app_meta.npy'
 INDICES = {'notifications', 'appevents', 'sessions', 'logs', 'connectivity'}
 INDEX_FIELDS = {
     'notifications': [
@@ -119,24 +126,76 @@ MIN_INDEX_FIELDS = {
         'surveyId',
         'time'],
 }
+# Data types to declare up front when streaming CSV files (see load)
+INDEX_DTYPES = {
+    'notifications': {
+        'application': 'category',
+        'id': 'category',
+        'notificationID': 'category',
+        'studyKey': 'category',
+        'surveyId': 'category'
+    },
+    'appevents': {
+        'application': 'category',
+        'battery': 'float32',
+        'id': 'category',
+        'latitude': 'float32',
+        'longitude': 'float32',
+        'model': 'category',
+        'session': 'category',
+        'studyKey': 'category',
+        'surveyId': 'category'
+    },
+    'sessions': {
+        'id': 'category',
+        'studyKey': 'category',
+        'surveyId': 'category'
+    },
+    'logs': {
+        'id': 'category',
+        'studyKey': 'category',
+        'surveyId': 'category'
+    },
+    'connectivity': {
+        'id': 'category',
+        'latitude': 'float32',
+        'longitude': 'float32',
+        'networkOperatorName': 'category',
+        'networkType': 'category',
+        'signalStrengthAsu': 'float32',
+        'signalStrengthDbm': 'float32',
+        'signalStrengthLevel': 'float32'
+    }
+}
+# Timestamp fields per index
+TIME_FIELDS = {
+    'notifications': ['time'],
+    'appevents': ['startTime', 'endTime'],
+    'sessions': ['timestamp', 'startTime', 'endTime'],
+    'logs': ['date'],
+    'connectivity': ['timestamp']
+}
 
 
 ####################
 # Helper functions #
 ####################
 
-def set_param(log_level=None, data_dir=None, cache_dir=None):
+def set_param(log_level=None, data_dir=None, cache_dir=None, meta_file=None):
     """
     Set mobileDNA parameters.
 
     :param log_level: new value for log level
     :param data_dir: new data directory
+    :param cache_dir: new cache directory
+    :param meta_file: new app meta data file name in cache directory (e.g., app_meta.feather)
     """
 
     # Declare these variables to be global
     global LOG_LEVEL
     global DATA_DIR
     global CACHE_DIR
+    global META_FILE
 
     # Set log level
     if log_level:
@@ -150,6 +209,10 @@ def set_param(log_level=None, data_dir=None, cache_dir=None):
     if cache_dir:
         CACHE_DIR = cache_dir
 
+    # Set new app meta data file
+    if meta_file:
+        META_FILE = meta_file
+
 
 def log(*message, lvl=3, sep="", title=False):
     """
@@ -271,18 +334,23 @@ def split_time_range(time_range: tuple, duration: pd.Timedelta, ignore_error=Fal
     return new_time_range
 
 
-def remove_first_and_last(df: pd.DataFrame, col='startDate') -> pd.DataFrame:
+def remove_first_and_last(df: pd.DataFrame, col='startDate', by=None) -> pd.DataFrame:
     """
     Chop the first and last day off of a data frame, on the basis of startDates.
-    WARNING: does this over the whole data frame, ignoring ids. Use in combination with groupby.
+    WARNING: without `by`, does this over the whole data frame, ignoring ids.
 
     :param df: input data frame
     :param col: column on which to perform operation
+    :param by: column to group on (e.g. 'id'), to cut off the first and last day per group in one pass
     :return: filtered data frame
     """
 
-    # Get first and last date
-    first, last = list(df[col].agg(['min', 'max']))
+    # Get first and last date (per group, aligned with the rows)
+    if by:
+        grouped = df.groupby(by, observed=True)[col]
+        first, last = grouped.transform('min'), grouped.transform('max')
+    else:
+        first, last = list(df[col].agg(['min', 'max']))
 
     # Restrict original df
     df = df.loc[(df[col] != first) & (df[col] != last)]
@@ -290,56 +358,95 @@ def remove_first_and_last(df: pd.DataFrame, col='startDate') -> pd.DataFrame:
     return df
 
 
-def longest_uninterrupted(df: pd.DataFrame, column='startDate') -> pd.DataFrame:
+def select_first_days(df: pd.DataFrame, n: int, col='startDate', by=None) -> pd.DataFrame:
     """
-    Filter data frame to retain longest uninterrupted logging period (based on designated column)
-    :param df: data frame
-    :param column: date column
+    Keep the first n days of a data frame, counting from its first date.
+    WARNING: without `by`, does this over the whole data frame, ignoring ids.
+
+    :param df: input data frame
+    :param n: number of days
+    :param col: date column
+    :param by: column to group on (e.g. 'id'), to count from the first date per group in one pass
     :return: filtered data frame
     """
 
-    if len(df.id.unique()) > 1:
-        raise Exception("Cannot apply function to data frame from multiple ids. Use groupby.")
+    start = df.groupby(by, observed=True)[col].transform('min') if by else df[col].min()
+    end = start + pd.Timedelta(n - 1, 'D')
 
-    # Get unique dates from data frame
-    dates = sorted(df[column].unique())
+    return df.loc[(df[col] >= start) & (df[col] <= end)]
 
-    # Silence some warnings
-    previous = None
-    run, longest = [], []
 
-    # Loop over indexed dates
-    for idx, date in enumerate(dates):
+def impose_min_days(df: pd.DataFrame, n: int, col='startDate', by='id') -> pd.DataFrame:
+    """
+    Drop groups (ids) that don't have a minimum of n unique days.
 
-        # Calculate difference
+    :param df: input data frame
+    :param n: number of days
+    :param col: date column
+    :param by: column to group on
+    :return: filtered data frame
+    """
 
-        # If we're at the first, set up our run (which is now the longest run)
-        if idx == 0:
+    days = df.groupby(by, observed=True)[col].transform('nunique')
 
-            run = [date]
-            longest = [date]
+    return df.loc[days >= n]
 
-        # If current date does not follow previous date, or if we reached end of the line
-        elif ((date - previous).astype('timedelta64[D]') / np.timedelta64(1, 'D')) != 1:
 
-            # Start new run
-            run = [date]
+def restrict_to_dates(df: pd.DataFrame, firsts: pd.Series, lasts: pd.Series, col='startTime') -> pd.DataFrame:
+    """
+    Restrict timestamps to the (first date, last date) range of their id, edges included.
+    Rows of ids without a range are dropped.
 
-        # In any other case, keep updating run
-        else:
-            run.append(date)
+    :param df: input data frame
+    :param firsts: first date per id
+    :param lasts: last date per id
+    :param col: timestamp column
+    :return: filtered data frame
+    """
 
-        if len(run) > len(longest):
-            longest = run
+    if len(firsts) == 0:
+        return df.iloc[:0]
 
-        # Remember last date
-        previous = date
+    # Look up the window of every row (compare datetimes directly: [first day 00:00, day after last day 00:00))
+    positions = pd.Index(firsts.index).get_indexer(df.id)
+    start = pd.to_datetime(firsts.values[positions]).values
+    stop = (pd.to_datetime(lasts.values[positions]) + pd.Timedelta(days=1)).values
+    times = df[col].values
 
-    # Print some output
-    log(f"Longest uninterrupted log period for {df.id.iloc[0]}: {len(longest)} days.", lvl=4)
+    return df.loc[(positions >= 0) & (times >= start) & (times < stop)]
+
+
+def longest_uninterrupted(df: pd.DataFrame, column='startDate') -> pd.DataFrame:
+    """
+    Filter data frame to retain longest uninterrupted logging period per id (based on designated column).
+    If an id has multiple runs of the same length, the first one is kept.
+
+    :param df: data frame
+    :param column: date column
+    :return: filtered data frame
+    """
+
+    # Get unique (id, date) pairs, sorted per id
+    pairs = df[['id', column]].drop_duplicates().sort_values(by=['id', column])
+    codes = pd.factorize(pairs.id)[0]
+    days = pd.to_datetime(pairs[column]).values.astype('datetime64[D]').astype(np.int64)
+
+    # A new run starts at every new id, and wherever a date does not follow the previous date
+    breaks = np.ones(len(pairs), dtype=bool)
+    breaks[1:] = (codes[1:] != codes[:-1]) | (np.diff(days) != 1)
+    runs = np.cumsum(breaks) - 1
+
+    # Pick the longest run per id (idxmax returns the first run on ties)
+    lengths = pd.Series(np.bincount(runs))
+    longest = lengths.groupby(codes[breaks]).idxmax().values
 
-    # Filter data frame
-    df = df.loc[df[column].isin(longest)]
+    # Filter data frame on the (id, date) pairs of these runs
+    keep = pd.MultiIndex.from_frame(pairs.loc[np.isin(runs, longest)])
+    df = df.loc[pd.MultiIndex.from_frame(df[['id', column]]).isin(keep)]
+
+    # Print some output
+    log(f"Longest uninterrupted log periods: {lengths[longest].mean() if len(longest) else 0:.1f} days on average.",
+        lvl=4)
 
     return df
 
@@ -638,6 +745,76 @@ def get_unique(column: str, df: pd.DataFrame) -> np.ndarray:
 
     return unique_values
 
+######################
+# Parallel functions #
+######################
+
+def _apply_to_shard(shard: pd.DataFrame, func: Callable, by_group: bool, kwargs: dict) -> pd.DataFrame:
+    """
+    Worker for apply_by_id: apply function to a shard of ids (per id, or to the shard as a whole).
+    """
+
+    if by_group:
+        return shard.groupby('id', observed=True, group_keys=False).apply(lambda df: func(df, **kwargs))
+
+    return func(shard, **kwargs)
+
+
+def apply_by_id(df: pd.DataFrame, func: Callable, n_jobs=1, chunk_size=None, by_group=True, desc=None,
+                **kwargs) -> pd.DataFrame:
+    """
+    Apply a function per id (like groupby('id').apply), optionally spread over multiple processes.
+    The data frame is sharded by id, shards are processed by a pool of workers, and the results are glued
+    back together in id order. Shards and results are sent between processes by pickling (each shard is copied
+    to its worker, not shared), and the function (and its keyword arguments) must be picklable too, so use
+    module-level functions rather than lambdas.
+
+    :param df: data frame with 'id' column
+    :param func: function taking a data frame (and kwargs), returning a data frame
+    :param n_jobs: number of processes (1 = run in this process, -1 = all cores)
+    :param chunk_size: number of ids per shard (default: spread ids over 4 shards per process)
+    :param by_group: apply function per id within a shard, or to the shard as a whole (for id-aware functions)
+    :param desc: progress bar description
+    :param kwargs: keyword arguments for the function
+    :return: concatenated results (original index is kept)
+    """
+
+    n_jobs = os.cpu_count() if n_jobs is None or n_jobs < 1 else n_jobs
+
+    # Single process: plain groupby
+    if n_jobs == 1:
+        if not by_group:
+            return func(df, **kwargs)
+
+        tqdm.pandas(desc=desc, position=0, leave=True)
+        return df.groupby('id', observed=True, group_keys=False).progress_apply(lambda data: func(data, **kwargs))
+
+    # Assign ids (in sorted order) to shards
+    codes, uniques = pd.factorize(df.id, sort=True)
+    if chunk_size is None:
+        chunk_size = max(1, int(np.ceil(len(uniques) / (4 * n_jobs))))
+    shard_codes = codes // chunk_size
+    order = np.argsort(shard_codes, kind='stable')
+    bounds = np.searchsorted(shard_codes[order], np.arange(shard_codes.max() + 2 if len(codes) else 1))
+
+    shards = [df.iloc[order[bounds[i]:bounds[i + 1]]] for i in range(len(bounds) - 1)]
+    results = [None] * len(shards)
+
+    log(f'Applying {func.__name__} to {len(uniques)} ids in {len(shards)} shards ({n_jobs} processes).', lvl=3)
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = {executor.submit(_apply_to_shard, shard, func, by_group, kwargs): i
+                   for i, shard in enumerate(shards)}
+
+        for future in tqdm(as_completed(futures), total=len(futures), desc=desc, position=0, leave=True):
+            results[futures[future]] = future.result()
+
+    if not results:
+        return df.iloc[:0]
+
+    return pd.concat(results)
+
+
 ###########################
 # Visualization functions #
 ###########################
@@ -667,7 +844,55 @@ def plot_logdays_freq(df: pd.DataFrame) -> plt.figure:
 #####################
 
 
-def save(df: pd.DataFrame, dir: str, name: str, csv_file=True, pickle=False, parquet=False):
+def save_dataset(df: pd.DataFrame, path: str, partition_by='id', row_group_size=None, write_statistics=True):
+    """
+    Store a data frame as a Hive-partitioned Parquet dataset (e.g., <path>/id=.../month=2021-12/part-0.parquet).
+    If partitioned by id, partitions that are written again replace the old ones and other partitions are left alone
+    (so saving the data of a single user only rewrites that user's files). A month partition holds the data of
+    several users, so without id partitions new files are added next to the old ones: saving the same rows twice
+    stores them twice.
+
+    :param df: data to store on disk
+    :param path: dataset directory
+    :param partition_by: 'id', 'month' (month of the first date/time column) or a list of both
+    :param row_group_size: maximum number of rows per row group
+    :param write_statistics: store column statistics (min/max) per row group, used to skip row groups when loading
+    :return: /
+    """
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partition_by = [partition_by] if isinstance(partition_by, str) else list(partition_by)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    # Derive month partition column (added to the table only, so the pandas metadata keeps the original columns)
+    if 'month' in partition_by and 'month' not in df.columns:
+        date_col = next(col for col in ['startDate', 'startTime', 'date', 'time', 'timestamp'] if col in df.columns)
+        table = table.append_column('month', pa.array(pd.to_datetime(df[date_col]).dt.strftime('%Y-%m')))
+
+    # Only replace partitions that belong to the ids being written
+    if 'id' in partition_by:
+        basename_template, existing_data_behavior = 'part-{i}.parquet', 'delete_matching'
+    else:
+        basename_template, existing_data_behavior = f'part-{uuid.uuid4().hex}-{{i}}.parquet', 'overwrite_or_ignore'
+
+    partitioning = ds.partitioning(pa.schema([table.schema.field(col) for col in partition_by]), flavor='hive')
+    file_options = ds.ParquetFileFormat().make_write_options(compression='snappy',
+                                                             write_statistics=write_statistics)
+
+    ds.write_dataset(table, base_dir=path,
+                     format='parquet',
+                     partitioning=partitioning,
+                     file_options=file_options,
+                     max_rows_per_group=row_group_size if row_group_size else 1024 * 1024,
+                     basename_template=basename_template,
+                     existing_data_behavior=existing_data_behavior)
+
+
+def save(df: pd.DataFrame, dir: str, name: str, csv_file=True, pickle=False, parquet=False, partition_by=None,
+         row_group_size=None, write_statistics=True):
     """
     Wrapper function to save mobileDNA data frames.
 
@@ -677,6 +902,10 @@ def save(df: pd.DataFrame, dir: str, name: str, csv_file=True, pickle=False, par
     :param csv_file: save in CSV format (bool)
     :param pickle: save in pickle format (bool)
     :param parquet: save in parquet format (bool)
+    :param partition_by: save parquet as a partitioned dataset directory instead, partitioned by
+                         'id', 'month' or both (see save_dataset)
+    :param row_group_size: maximum number of rows per parquet row group
+    :param write_statistics: store parquet column statistics
     :return: /
     """
 
@@ -711,11 +940,24 @@ def save(df: pd.DataFrame, dir: str, name: str, csv_file=True, pickle=False, par
 
             log("ERROR: Failed to pickle data frame! {e}".format(e=e), lvl=1)
 
+    # Store to partitioned parquet dataset
+    if parquet and partition_by:
+
+        try:
+            save_dataset(df=df, path=path, partition_by=partition_by, row_group_size=row_group_size,
+                         write_statistics=write_statistics)
+            log("Saved data frame to dataset {}".format(path))
+
+        except Exception as e:
+
+            log("ERROR: Failed to store data frame as parquet dataset! {e}".format(e=e), lvl=1)
+
     # Store to parquet
-    if parquet:
+    elif parquet:
 
         try:
-            df.to_parquet(path=path + ".parquet", engine='auto', compression='snappy')
+            df.to_parquet(path=path + ".parquet", engine='auto', compression='snappy',
+                          row_group_size=row_group_size, write_statistics=write_statistics)
             log("Saved data frame to {}".format(path + ".parquet"))
 
         except Exception as e:
@@ -723,8 +965,312 @@ def save(df: pd.DataFrame, dir: str, name: str, csv_file=True, pickle=False, par
             log("ERROR: Failed to store data frame as parquet! {e}".format(e=e), lvl=1)
 
 
+def get_time_field(index: str, columns) -> str:
+    """
+    Get the (first) timestamp field of an index that is present in the given columns, to filter on dates.
+
+    :param index: type of mobileDNA data
+    :param columns: available columns
+    :return: name of timestamp field (raises ValueError if there is none)
+    """
+
+    for col in TIME_FIELDS[index]:
+        if col in columns:
+            return col
+
+    raise ValueError(f"ERROR: Can't filter on dates, none of the time fields of <{index}> "
+                     f"({', '.join(TIME_FIELDS[index])}) are in the data.")
+
+
+def get_date_bounds(date_range: tuple) -> tuple:
+    """
+    Turn an inclusive (first date, last date) range into half-open timestamp bounds.
+
+    :param date_range: tuple with first and last date (either can be None for an open end)
+    :return: tuple with start (included) and stop (excluded) timestamps
+    """
+
+    first, last = date_range
+    start = pd.Timestamp(first).normalize() if first is not None else None
+    stop = pd.Timestamp(last).normalize() + pd.Timedelta(days=1) if last is not None else None
+
+    return start, stop
+
+
+def to_list(values) -> list:
+    """
+    Normalise a filter argument (single value, list, set, array, Index, Series) to a list.
+
+    :param values: value(s) to filter on
+    :return: list of values (None if values is None)
+    """
+
+    if values is None:
+        return None
+
+    if isinstance(values, (str, bytes)) or np.ndim(values) == 0:
+        return [values]
+
+    return list(values)
+
+
+def filter_rows(df: pd.DataFrame, index: str, users=None, date_range=None, applications=None) -> pd.DataFrame:
+    """
+    Restrict a data frame to a set of users, a date range and/or a set of applications.
+
+    :param df: data frame to filter
+    :param index: type of mobileDNA data
+    :param users: ids to keep
+    :param date_range: tuple with first and last date to keep (included)
+    :param applications: applications to keep
+    :return: filtered data frame
+    """
+
+    mask = pd.Series(True, index=df.index)
+
+    if users is not None:
+        mask &= df['id'].isin(to_list(users))
+
+    if applications is not None:
+        mask &= df['application'].isin(to_list(applications))
+
+    if date_range:
+        time_col = get_time_field(index=index, columns=df.columns)
+        times = pd.to_datetime(df[time_col])
+        start, stop = get_date_bounds(date_range=date_range)
+
+        if start is not None:
+            mask &= times >= start
+        if stop is not None:
+            mask &= times < stop
+
+    return df.loc[mask] if not mask.all() else df
+
+
+def get_filter_expression(dataset, index: str, users=None, date_range=None, applications=None):
+    """
+    Build a pyarrow filter expression on ids, applications and dates, to be pushed down to a Parquet dataset.
+
+    :param dataset: pyarrow dataset
+    :param index: type of mobileDNA data
+    :param users: ids to keep
+    :param date_range: tuple with first and last date to keep (included)
+    :param applications: applications to keep
+    :return: filter expression (None if there is nothing to filter on)
+    """
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    schema = dataset.schema
+
+    # Build filter expression
+    expression = None
+
+    def add(condition):
+        return condition if expression is None else expression & condition
+
+    if users is not None:
+        expression = add(ds.field('id').isin(to_list(users)))
+
+    if applications is not None:
+        expression = add(ds.field('application').isin(to_list(applications)))
+
+    if date_range:
+        time_col = get_time_field(index=index, columns=schema.names)
+        start, stop = get_date_bounds(date_range=date_range)
+
+        # Compare as timestamps (cast if timestamps were stored as strings)
+        field_type = schema.field(time_col).type
+        if pa.types.is_timestamp(field_type):
+            time_field = ds.field(time_col)
+        else:
+            field_type = pa.timestamp('ns')
+            time_field = ds.field(time_col).cast(field_type)
+
+        if start is not None:
+            expression = add(time_field >= pa.scalar(start.to_pydatetime(), type=field_type))
+        if stop is not None:
+            expression = add(time_field < pa.scalar(stop.to_pydatetime(), type=field_type))
+
+        # Prune month partitions (see save_dataset)
+        if 'month' in dataset.partitioning.schema.names:
+            if start is not None:
+                expression = add(ds.field('month') >= start.strftime('%Y-%m'))
+            if stop is not None:
+                expression = add(ds.field('month') <= (stop - pd.Timedelta(days=1)).strftime('%Y-%m'))
+
+    return expression
+
+
+def open_dataset(path: str):
+    """
+    Open a Parquet file or Hive-partitioned dataset directory (see save_dataset) as pyarrow dataset.
+    Partition values are read as plain strings (not dictionaries), see restore_partition_columns for the rest.
+
+    :param path: location of Parquet file or dataset directory
+    :return: pyarrow dataset
+    """
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    # Single file
+    if os.path.isfile(path):
+        return ds.dataset(path, format='parquet')
+
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    partition_names = dataset.partitioning.schema.names if dataset.partitioning else []
+
+    if not partition_names:
+        return dataset
+
+    # Don't let pyarrow guess partition types (numeric looking ids, dictionaries)
+    partitioning = ds.partitioning(pa.schema([(name, pa.string()) for name in partition_names]), flavor='hive')
+
+    return ds.dataset(path, format='parquet', partitioning=partitioning)
+
+
+def restore_partition_columns(df: pd.DataFrame, dataset) -> pd.DataFrame:
+    """
+    Undo what partitioning did to a data frame read from a dataset (see save_dataset), based on the pandas
+    metadata stored with the files: partition columns get their original type, partition-only columns (month)
+    are dropped, and the original column order is restored.
+
+    :param df: data frame read from the dataset
+    :param dataset: pyarrow dataset (see open_dataset)
+    :return: data frame
+    """
+
+    partition_names = dataset.partitioning.schema.names if dataset.partitioning else []
+    metadata = dataset.schema.metadata or {}
+
+    if not partition_names or b'pandas' not in metadata:
+        return df
+
+    columns = {column['name']: column for column in json.loads(metadata[b'pandas'])['columns']
+               if column['name'] is not None}
+
+    for name in partition_names:
+        if name not in df.columns:
+            continue
+
+        # Partition-only column
+        if name not in columns:
+            df = df.drop(columns=[name])
+
+        # Original type
+        elif columns[name]['pandas_type'] == 'categorical':
+            df[name] = df[name].astype('category')
+        elif columns[name]['numpy_type'] != 'object':
+            df[name] = df[name].astype(columns[name]['numpy_type'])
+
+    order = [column for column in columns if column in df.columns]
+
+    return df[order + [column for column in df.columns if column not in order]]
+
+
+def read_parquet_filtered(path: str, index: str, columns=None, users=None, date_range=None, applications=None,
+                          dtype_backend=None) -> pd.DataFrame:
+    """
+    Read a Parquet file or (partitioned) dataset directory through pyarrow, pushing column selection and row
+    filters down to the dataset layer: row groups (and partitions) that don't match are never decoded.
+
+    :param path: location of Parquet file or dataset directory
+    :param index: type of mobileDNA data
+    :param columns: columns to load (default: all)
+    :param users: ids to keep
+    :param date_range: tuple with first and last date to keep (included)
+    :param applications: applications to keep
+    :param dtype_backend: 'pyarrow' to keep Arrow-backed columns (pandas 1.5 and up), otherwise NumPy-backed
+                          (categoricals for dictionary columns, datetime64 for timestamps)
+    :return: data frame
+    """
+
+    dataset = open_dataset(path)
+    expression = get_filter_expression(dataset=dataset, index=index, users=users, date_range=date_range,
+                                       applications=applications)
+
+    # Only decode what we need
+    table = dataset.to_table(columns=columns, filter=expression)
+
+    if dtype_backend == 'pyarrow':
+
+        # Arrow-backed columns (pd.ArrowDtype) need pandas 1.5
+        if not hasattr(pd, 'ArrowDtype'):
+            raise Exception(f"ERROR: dtype_backend='pyarrow' needs pandas 1.5 or later (found {pd.__version__}).")
+
+        return restore_partition_columns(df=table.to_pandas(types_mapper=pd.ArrowDtype), dataset=dataset)
+
+    return restore_partition_columns(df=table.to_pandas(), dataset=dataset)
+
+
+def read_csv_chunked(path: str, index: str, sep=';', dec='.', usecols=None, chunksize=1_000_000,
+                     **filters) -> pd.DataFrame:
+    """
+    Read a (large) CSV file in chunks, with data types declared up front (see INDEX_DTYPES) and timestamps
+    parsed while reading. Categorical columns are unified across chunks, so peak memory stays close to the
+    size of the final data frame.
+
+    :param path: location of CSV file
+    :param index: type of mobileDNA data
+    :param sep: field separator
+    :param dec: decimal symbol
+    :param usecols: columns to load (default: all)
+    :param chunksize: number of rows per chunk
+    :param filters: users, date_range and/or applications to keep (applied to each chunk, see filter_rows)
+    :return: data frame
+    """
+
+    # Peek at the header to see which columns we'll get
+    header = pd.read_csv(filepath_or_buffer=path, sep=sep, nrows=0).columns
+    columns = [col for col in header if usecols is None or col in usecols]
+
+    dtype = {col: col_type for col, col_type in INDEX_DTYPES[index].items() if col in columns}
+    parse_dates = [col for col in TIME_FIELDS[index] if col in columns]
+
+    reader = pd.read_csv(filepath_or_buffer=path,
+                         sep=sep, decimal=dec,
+                         on_bad_lines='warn',
+                         usecols=usecols,
+                         dtype=dtype,
+                         parse_dates=parse_dates,
+                         chunksize=chunksize)
+
+    # Keep columns of each chunk (not the chunks themselves), so memory is released column by column later
+    parts = {col: [] for col in columns}
+    n_chunks = 0
+
+    for chunk in reader:
+        chunk = filter_rows(df=chunk, index=index, **filters)
+
+        for col in columns:
+            parts[col].append(chunk[col])
+        n_chunks += 1
+
+        log(f"Read chunk {n_chunks} ({len(chunk)} rows).", lvl=3)
+
+    # Stitch columns together, unifying categories across chunks
+    data = {}
+
+    for col in columns:
+        col_parts = parts.pop(col)
+
+        if not col_parts:
+            data[col] = pd.Series(dtype=dtype.get(col, object))
+        elif dtype.get(col) == 'category':
+            data[col] = pd.Series(union_categoricals(col_parts))
+        else:
+            data[col] = pd.concat(col_parts, ignore_index=True)
+
+        del col_parts
+
+    return pd.DataFrame(data, columns=columns)
+
+
 @time_it
-def load(path: str, index: str, file_type='infer', sep=';', dec='.', format=False, bare=False) -> pd.DataFrame:
+def load(path: str, index: str, file_type='infer', sep=';', dec='.', format=False, bare=False,
+         chunksize=None, users=None, date_range=None, applications=None, dtype_backend=None) -> pd.DataFrame:
     """
     Wrapper function to load mobileDNA data frames.
 
@@ -733,7 +1279,14 @@ def load(path: str, index: str, file_type='infer', sep=';', dec='.', format=Fals
     :param file_type: file type (default: infer from path, other options: pickle, csv, or parquet)
     :param sep: field separator
     :param dec: decimal symbol
+    :param format: set data types after loading (see format_data)
     :param bare: load only the most necessary columns for a more lightweight dataframe
+    :param chunksize: stream CSV files in chunks of this many rows, with data types declared up front
+                      (lower peak memory for large files)
+    :param users: only load these ids
+    :param date_range: only load this (first date, last date) range, edges included
+    :param applications: only load these applications
+    :param dtype_backend: 'pyarrow' to get Arrow-backed columns from Parquet files (pandas 1.5 and up)
     :return: data frame
     """
 
@@ -745,11 +1298,14 @@ def load(path: str, index: str, file_type='infer', sep=';', dec='.', format=Fals
     # Set params if bare loading
     usecols = columns = MIN_INDEX_FIELDS[index] if bare else None
 
+    # Row filters (pushed down for Parquet, applied while reading for CSV)
+    filters = {'users': users, 'date_range': date_range, 'applications': applications}
+
     # Load data frame, depending on file type
     if file_type == 'infer':
 
-        # Get extension
-        file_type = path.split('.')[-1]
+        # Get extension (directories are read as partitioned Parquet datasets)
+        file_type = 'parquet' if os.path.isdir(path) else path.split('.')[-1]
 
         # Only allow the following extensions
         if file_type not in ['csv', 'pickle', 'pkl', 'parquet']:
@@ -757,8 +1313,13 @@ def load(path: str, index: str, file_type='infer', sep=';', dec='.', format=Fals
 
         log("Recognized file type as <{type}>.".format(type=file_type), lvl=3)
 
+    # CSV (streaming)
+    if file_type == 'csv' and chunksize:
+        df = read_csv_chunked(path=path, index=index, sep=sep, dec=dec, usecols=usecols, chunksize=chunksize,
+                              **filters)
+
     # CSV
-    if file_type == 'csv':
+    elif file_type == 'csv':
         df = pd.read_csv(filepath_or_buffer=path,
                          # usecols=,
                          sep=sep, decimal=dec,
@@ -769,6 +1330,11 @@ def load(path: str, index: str, file_type='infer', sep=';', dec='.', format=Fals
     elif file_type == 'pickle' or file_type == 'pkl':
         df = pd.read_pickle(path=path)
 
+    # Parquet (filtered)
+    elif file_type == 'parquet' and (any(value is not None for value in filters.values()) or dtype_backend or
+                                     os.path.isdir(path)):
+        df = read_parquet_filtered(path=path, index=index, columns=columns, dtype_backend=dtype_backend, **filters)
+
     # Parquet
     elif file_type == 'parquet':
         df = pd.read_parquet(path=path,
@@ -779,6 +1345,10 @@ def load(path: str, index: str, file_type='infer', sep=';', dec='.', format=Fals
     else:
         raise Exception("ERROR: You want me to read what now? Invalid file type! ")
 
+    # Apply row filters after loading if they weren't applied yet
+    if file_type in ['pickle', 'pkl'] or (file_type == 'csv' and not chunksize):
+        df = filter_rows(df=df, index=index, **filters)
+
     # If there's nothing there, just go ahead and return the empty df
     if df.empty:
         return df
@@ -806,34 +1376,236 @@ def load(path: str, index: str, file_type='infer', sep=';', dec='.', format=Fals
 # App metadata #
 ################
 
-def load_meta(path=None) -> dict:
+# App meta data that was loaded before, per path (reloaded when the file changes)
+_META_REGISTRY = {}
+
+# Columnar formats for app meta data (Arrow/Feather files are stored uncompressed, so they can be memory-mapped)
+META_FORMATS = {'.npy': 'npy', '.feather': 'feather', '.arrow': 'feather', '.parquet': 'parquet'}
+
+
+def _meta_format(path: str) -> str:
+    """
+    Get the storage format of an app meta data file from its extension.
+
+    :param path: location of the app meta data file
+    :return: format (npy, feather or parquet)
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension not in META_FORMATS:
+        raise Exception(f"ERROR: Unknown app meta data format <{extension}>! Choose from {list(META_FORMATS)}.")
+
+    return META_FORMATS[extension]
+
+
+def _arrow_types_mapper():
+    """
+    Map Arrow integer types to pandas nullable integers, so integer fields with gaps don't turn into floats.
+    """
+
+    import pyarrow as pa
+
+    return {pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype(),
+            pa.int64(): pd.Int64Dtype()}.get
+
+
+class MetaTable(Mapping):
     """
-    Load the app meta data dictionary
+    Read-only {app: fields} view on a (memory-mapped) Arrow table of app meta data.
+    Only the application index is built in memory: fields are read from the table when an app is looked up,
+    so processes mapping the same file share one copy of the data.
+    """
+
+    def __init__(self, table):
+
+        self.table = table
+        self.rows = {app: row for row, app in enumerate(table.column('application').to_pylist())}
+
+    def __getitem__(self, app: str) -> dict:
+
+        # (Table.to_pylist needs pyarrow 7)
+        fields = self.table.slice(self.rows[app], 1).to_pydict()
+
+        return {field: values[0] for field, values in fields.items()
+                if field != 'application' and values[0] is not None and not pd.isna(values[0])}
+
+    def __iter__(self):
+
+        return iter(self.rows)
+
+    def __len__(self) -> int:
+
+        return len(self.rows)
+
+    def __contains__(self, app) -> bool:
+
+        return app in self.rows
+
+
+def _get_meta_entry(path: str) -> dict:
+    """
+    Get the registry entry for an app meta data file, (re)loading it if the file is new or has changed.
+
+    :param path: location of the app meta data file
+    :return: registry entry with modification time, meta data dictionary (or table view) and data frame (built lazily)
+    """
+
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+
+    entry = _META_REGISTRY.get(path)
+
+    if entry is None or entry['mtime'] != mtime:
+        entry = {'mtime': mtime, 'meta': None, 'frame': None, 'table': None}
+
+        # Pickled dict
+        if _meta_format(path) == 'npy':
+            entry['meta'] = dict(np.load(file=path, allow_pickle=True).item())
+
+        # Columnar formats are memory-mapped and kept as Arrow table, so processes reading the same file share the
+        # OS page cache (feather is stored uncompressed, so its columns are not even copied)
+        else:
+            import pyarrow.feather as feather
+            import pyarrow.parquet as pq
+
+            if _meta_format(path) == 'feather':
+                table = feather.read_table(path, memory_map=True)
+            else:
+                table = pq.read_table(path, memory_map=True)
+
+            entry['table'] = table
+            entry['meta'] = MetaTable(table=table)
+
+        _META_REGISTRY[path] = entry
+
+    return entry
+
+
+def clear_meta_cache():
+    """
+    Forget all app meta data that was loaded in this process.
+    """
+
+    _META_REGISTRY.clear()
+
+
+def load_meta(path=None, copy=True) -> dict:
+    """
+    Load the app meta data dictionary (from .npy, .feather/.arrow or .parquet).
+    The file is only read once per process, and again when it changes on disk.
+
     :param path: if custom path, specify here, otherwise default cache location
+    :param copy: return a copy that can safely be edited (set to False for read-only use, columnar files then give
+                 a MetaTable view on the memory-mapped table)
     :return: app meta data dictionary
     """
 
     # If not specified, load from standard location
     if not path:
-        path = os.path.join(CACHE_DIR, 'app_meta.npy')
+        path = os.path.join(CACHE_DIR, META_FILE)
 
-    app_meta = dict(np.load(file=path, allow_pickle=True).item())
+    app_meta = _get_meta_entry(path=path)['meta']
+
+    if copy:
+        app_meta = {app: dict(fields) for app, fields in app_meta.items()}
 
     return app_meta
 
 
-def save_meta(app_meta: dict, dir=None, name='app_meta.npy'):
+def get_meta_frame(path=None) -> pd.DataFrame:
+    """
+    Get the app meta data as a data frame, indexed by application (package name), for vectorized lookups and joins.
+    WARNING: the data frame is shared between callers, don't modify it.
+
+    :param path: if custom path, specify here, otherwise default cache location
+    :return: app meta data frame
+    """
+
+    # If not specified, load from standard location
+    if not path:
+        path = os.path.join(CACHE_DIR, META_FILE)
+
+    entry = _get_meta_entry(path=path)
+
+    # Build the data frame on first use
+    if entry['frame'] is None and entry['table'] is not None:
+        entry['frame'] = entry['table'].to_pandas(types_mapper=_arrow_types_mapper()).set_index('application')
+    elif entry['frame'] is None:
+        entry['frame'] = pd.DataFrame.from_dict(entry['meta'], orient='index').rename_axis('application')
+
+    return entry['frame']
+
+
+def save_meta(app_meta: dict, dir=None, name=None):
     """
-    Save the app meta data dictionary
+    Save the app meta data dictionary.
+    The format follows from the file extension: .npy (pickled dict), .feather/.arrow or .parquet (columnar,
+    one row per application).
+
     :param app_meta: app meta data dictionary to store
     :param dir: if custom directory, specify here, otherwise default cache location
+    :param name: if custom file name, specify here, otherwise default file name
     """
 
     # If not specified, load from standard location
     if not dir:
         dir = CACHE_DIR
+    if not name:
+        name = META_FILE
+
+    path = os.path.join(dir, name)
+    format = _meta_format(path)
+
+    # Pickled dict
+    if format == 'npy':
+        np.save(file=path, arr=app_meta)
+
+    # Columnar formats
+    else:
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        import pyarrow.parquet as pq
+
+        frame = pd.DataFrame.from_dict(app_meta, orient='index').rename_axis('application').reset_index()
+
+        # Keep integer fields integer, even when some apps miss them
+        for column in frame.columns:
+            values = [fields[column] for fields in app_meta.values()
+                      if fields.get(column) is not None and not pd.isna(fields[column])]
+            if values and all(isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+                              for value in values):
+                frame[column] = frame[column].astype('Int64')
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+
+        if format == 'feather':
+            feather.write_feather(table, path, compression='uncompressed')
+        else:
+            pq.write_table(table, path, compression='snappy')
+
+    # Make sure the next load picks up the new version
+    _META_REGISTRY.pop(os.path.abspath(path), None)
+
+
+def convert_meta(path: str = None, name='app_meta.feather', dir=None):
+    """
+    Convert a pickled (.npy) app meta data cache to a columnar format.
+
+    :param path: location of the .npy file (default: app_meta.npy in cache location)
+    :param name: name of the new file, its extension determines the format (.feather/.arrow or .parquet)
+    :param dir: directory of the new file (default: same directory as the .npy file)
+    """
+
+    # If not specified, load from standard location
+    if not path:
+        path = os.path.join(CACHE_DIR, 'app_meta.npy')
+    if not dir:
+        dir = os.path.dirname(path)
+
+    app_meta = dict(np.load(file=path, allow_pickle=True).item())
+    save_meta(app_meta=app_meta, dir=dir, name=name)
 
-    np.save(file=os.path.join(dir, name), arr=app_meta)
+    log(f"Converted <{path}> to <{os.path.join(dir, name)}>.", lvl=2)
 
 
 def edit_meta(app_meta: dict, app_name: str, changes: dict, overwrite=True) -> dict:
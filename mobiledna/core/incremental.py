@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+
+"""
+    __  ___      __    _ __     ____  _   _____
+   /  |/  /___  / /_  (_) /__  / __ \/ | / /   |
+  / /|_/ / __ \/ __ \/ / / _ \/ / / /  |/ / /| |
+ / /  / / /_/ / /_/ / / /  __/ /_/ / /|  / ___ |
+/_/  /_/\____/_.___/_/_/\___/_____/_/ |_/_/  |_|
+
+INCREMENTAL FEATURES CLASS
+Mergeable partial aggregates per (id, date), updated with newly arrived appevents
+"""
+
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+import mobiledna.core.help as hlp
+from mobiledna.core.annotate import add_category
+from mobiledna.core.features import SEARCH_APPS, NOTES_APPS, get_window_hours, count_window_hours
+from mobiledna.core.help import log
+
+# Partial sums per (id, date): {column: (row filter, value column)}
+DAY_SUMS = {
+    'events': (None, 'application'),
+    'duration': (None, 'duration'),
+    'socmed_events': ('socmed', 'application'),
+    'socmed_taps': ('socmed_taps', 'application'),
+    'socmed_duration': ('socmed', 'duration'),
+    'calls_events': ('calls', 'application'),
+    'calls_duration': ('calls', 'duration'),
+    'search_events': ('search', 'application'),
+    'search_duration': ('search', 'duration'),
+    'notes_events': ('notes', 'application'),
+    'notes_duration': ('notes', 'duration'),
+    'sleep_events': ('sleep', 'duration'),
+    'sleep_duration': ('sleep', 'duration'),
+}
+
+# Distinct counts per (id, date): {column: key column}
+DAY_KEYS = {
+    'sessions': 'session',
+    'apps': 'application',
+}
+
+
+class IncrementalFeatures:
+    """
+    Stores mergeable partial aggregates of appevents (counts, sums, sums of squares, min/max and distinct key counts,
+    mostly per (id, date)), so features can be updated with the rows of a new day instead of recomputing them from the
+    full history. Means and standard deviations are finalized on demand.
+
+    Covers the anhedonia, memory and sleep features (see features.py) and the Appevents daily getters (unfiltered).
+    The median time until an app is reopened (median_same_app_s) can't be merged and is left out.
+
+    The stored sums grow with the number of (id, date) pairs. Distinct counts and reopen gaps need the keys (sessions,
+    apps) and last app uses that were seen before, but only those of each id's last date are kept: dates only go up,
+    so only sessions running past midnight carry over to the next update. Rows of an id's earlier dates can still be
+    added, but sessions or apps that were already counted on such a date are then counted again.
+    """
+
+    def __init__(self, sleep_start=dt.time(0, 0, 0), sleep_end=dt.time(7, 0, 0)):
+
+        self.__sleep_window__ = (sleep_start, sleep_end)
+
+        # Sums and distinct session/app counts per (id, date)
+        self.__days__ = pd.DataFrame(columns=list(DAY_SUMS) + list(DAY_KEYS),
+                                     index=pd.MultiIndex.from_arrays([[], []], names=['id', 'date']))
+
+        # Keys seen on the last date of their id, with the date they were last seen on, to only count new keys in
+        # distinct counts: (id, date, session), (id, date, application) and (id, session)
+        self.__seen__ = {column: {} for column in list(DAY_KEYS) + ['id_sessions']}
+
+        # Last date per id (keys and last uses of earlier dates are dropped)
+        self.__last_dates__ = pd.Series(dtype=object)
+
+        # Distinct sessions per id (across dates)
+        self.__id_sessions__ = pd.Series(dtype=float)
+
+        # Categorical ids: features of filters without rows are 0 instead of NaN (like a groupby on categorical ids)
+        self.__categorical_ids__ = False
+
+        # Sessions counted in the Sessions index, per id
+        self.__session_counts__ = pd.Series(dtype=float)
+
+        # Last end time per (id, session, application) of sessions that are still open, and count/sum/sum of squares
+        # of reopen gaps per id
+        self.__last_use__ = pd.Series(dtype='datetime64[ns]')
+        self.__gaps__ = pd.DataFrame(columns=['n', 'sum', 'sumsq'], dtype=float)
+
+        # First app use and last app use (corrected by four hours) per (id, corrected date)
+        self.__sleep_days__ = pd.DataFrame(columns=['start_correct', 'end_correct'])
+
+        # First and last start time per id (span of the hourly bins)
+        self.__span__ = pd.DataFrame(columns=['first', 'last'])
+
+    # Updating #
+    ############
+
+    @staticmethod
+    def _combine(state, new, how):
+        """
+        Merge new partial aggregates into the stored ones, on their (multi-)index
+        """
+
+        if len(state) == 0:
+            return new
+
+        return pd.concat([state, new]).groupby(level=list(range(new.index.nlevels)), observed=True).agg(how)
+
+    def update(self, df: pd.DataFrame, df_s: pd.DataFrame = None):
+        """
+        Merge new appevents (and sessions) into the partial aggregates.
+        Rows are expected to be new (e.g. the next day of data): feeding the same rows twice counts them twice.
+        The data frames passed are not changed.
+
+        :param df: appevents data frame with new rows
+        :param df_s: sessions data frame with new rows (for sessions_empty_pct)
+        :return: IncrementalFeatures object
+        """
+
+        # Ids are stored as plain values, so partial aggregates of updates with other categories still merge
+        if isinstance(df['id'].dtype, pd.CategoricalDtype):
+            self.__categorical_ids__ = True
+            df = df.assign(id=df['id'].astype(object))
+            if df_s is not None:
+                df_s = df_s.assign(id=df_s['id'].astype(object))
+
+        # add_category adds its column in place: work on a copy
+        if 'category' not in df.columns:
+            df = add_category(df=df.copy())
+        if 'duration' not in df.columns:
+            df = df.assign(duration=(df.endTime - df.startTime).dt.total_seconds())
+        if 'date' not in df.columns:
+            df = df.assign(date=df.startTime.dt.date)
+
+        self._update_days(df)
+        self._update_gaps(df)
+        self._update_sleep(df)
+        self._prune()
+
+        if df_s is not None:
+            counts = df_s.groupby('id', observed=True)['session on'].count()
+            self.__session_counts__ = self._combine(self.__session_counts__, counts, how='sum')
+
+        log(f'Updated incremental features with {len(df)} appevents.', lvl=3)
+
+        return self
+
+    def _update_days(self, df: pd.DataFrame):
+
+        social = df.category == 'social'
+        window_hours = get_window_hours(*self.__sleep_window__)
+        masks = {
+            'socmed': social,
+            'socmed_taps': social & (df.notification == True),
+            'calls': df.category == 'calling',
+            'search': df.application.isin(SEARCH_APPS),
+            'notes': df.application.isin(NOTES_APPS),
+            'sleep': pd.Series(window_hours[df.startTime.dt.hour.values], index=df.index),
+        }
+
+        # Counts and sums in a single groupby: the value column, blanked out where the filter doesn't hold
+        values = pd.DataFrame({column: df[value] if mask is None else df[value].where(masks[mask])
+                               for column, (mask, value) in DAY_SUMS.items()})
+        values[['id', 'date']] = df[['id', 'date']]
+        how = {column: ('sum' if column.endswith('duration') else 'count') for column in DAY_SUMS}
+
+        # Only (id, date) pairs with rows
+        days = values.groupby(['id', 'date'], observed=True).agg(how)
+
+        # Distinct counts don't add up across updates: only count the keys that weren't seen before
+        for column, key in DAY_KEYS.items():
+            new_keys = self._new_keys(column, df[['id', 'date', key]], dates=df['date'])
+            days[column] = new_keys.groupby(['id', 'date'], observed=True).size().reindex(days.index, fill_value=0)
+
+        id_sessions = self._new_keys('id_sessions', df[['id', 'session']], dates=df['date'])
+        id_sessions = id_sessions.groupby('id', observed=True).size()
+        self.__id_sessions__ = self._combine(self.__id_sessions__, id_sessions, how='sum')
+
+        self.__days__ = self._combine(self.__days__, days, how='sum')
+
+        last_dates = days.index.to_frame(index=False).groupby('id')['date'].max()
+        self.__last_dates__ = self._combine(self.__last_dates__, last_dates, how='max')
+
+    def _new_keys(self, name: str, keys: pd.DataFrame, dates: pd.Series) -> pd.DataFrame:
+        """
+        Distinct keys (rows) that weren't seen in earlier updates, and mark them as seen (with the last date they were
+        seen on, see _prune)
+        """
+
+        columns = list(keys.columns)
+        keys = keys.assign(last_date=dates).dropna(subset=columns).sort_values('last_date')
+        keys = keys.drop_duplicates(subset=columns, keep='last')
+        seen = self.__seen__[name]
+
+        tuples = list(keys[columns].itertuples(index=False, name=None))
+        new = np.array([key not in seen for key in tuples], dtype=bool)
+        seen.update(zip(tuples, keys['last_date']))
+
+        return keys.loc[new, columns]
+
+    def _prune(self):
+        """
+        Forget the keys and last app uses of dates before the last date of their id (those sessions are closed)
+        """
+
+        last_dates = self.__last_dates__
+
+        for name, seen in self.__seen__.items():
+            self.__seen__[name] = {key: date for key, date in seen.items() if date >= last_dates[key[0]]}
+
+        # Sessions that ended before the last date started
+        if len(self.__last_use__):
+            ids = self.__last_use__.index.get_level_values('id')
+            starts = pd.to_datetime(last_dates.reindex(ids).values)
+            self.__last_use__ = self.__last_use__[self.__last_use__.values >= starts]
+
+    def _update_gaps(self, df: pd.DataFrame):
+
+        keys = ['id', 'session', 'application']
+        data = df[keys + ['startTime', 'endTime']].dropna(subset=keys).sort_values(by=['id', 'startTime'])
+
+        # Time between the end of an app and its next start in the same session (also across updates)
+        previous_end = data.groupby(keys, observed=True)['endTime'].shift(1)
+        if len(self.__last_use__):
+            last_use = self.__last_use__.reindex(pd.MultiIndex.from_frame(data[keys])).values
+            previous_end = previous_end.fillna(pd.Series(last_use, index=data.index))
+
+        gaps = (data['startTime'] - previous_end).dt.total_seconds().rename('gap').to_frame()
+        gaps['id'] = data['id']
+        gaps = gaps.dropna().assign(gap_sq=lambda frame: frame['gap'] ** 2)
+        gaps = gaps.groupby('id', observed=True).agg(n=('gap', 'count'), sum=('gap', 'sum'), sumsq=('gap_sq', 'sum'))
+
+        self.__gaps__ = self._combine(self.__gaps__, gaps, how='sum')
+
+        last_use = data.groupby(keys, observed=True)['endTime'].last()
+        self.__last_use__ = self._combine(self.__last_use__, last_use, how='last')
+
+    def _update_sleep(self, df: pd.DataFrame):
+
+        # Correct for usage after 24h (see calc_sleep_pattern)
+        data = pd.DataFrame({'id': df['id'],
+                             'start_correct': df['startTime'] - dt.timedelta(hours=4),
+                             'end_correct': df['endTime'] - dt.timedelta(hours=4)})
+        data['start_date_correct'] = data['start_correct'].dt.date
+
+        sleep_days = data.groupby(['id', 'start_date_correct'], observed=True).agg({'start_correct': 'min',
+                                                                                    'end_correct': 'max'})
+        self.__sleep_days__ = self._combine(self.__sleep_days__, sleep_days,
+                                            how={'start_correct': 'min', 'end_correct': 'max'})
+
+        span = df.groupby('id', observed=True)['startTime'].agg(['min', 'max']).set_axis(['first', 'last'], axis=1)
+        self.__span__ = self._combine(self.__span__, span, how={'first': 'min', 'last': 'max'})
+
+    # Finalizing #
+    ##############
+
+    def _per_id(self, column: str, logdays: pd.Series, count_column=None) -> pd.Series:
+        """
+        Average daily value of a partial sum. Like the features, ids without rows of its filter get NaN, or 0 if the
+        ids were categorical.
+        """
+
+        totals = self.__days__[column].groupby(level='id', observed=True).sum()
+        counts = self.__days__[count_column or column].groupby(level='id', observed=True).sum()
+
+        if self.__categorical_ids__:
+            return totals / logdays
+
+        return (totals / logdays).where(counts > 0)
+
+    def get_anhedonia_features(self) -> pd.DataFrame:
+        """
+        Returns the anhedonia features (see features_calc_anhedonia)
+        """
+
+        logdays = self.get_days()
+
+        return pd.DataFrame({
+            'daily_appevents': self._per_id('events', logdays),
+            'daily_duration': self.__days__['duration'].groupby(level='id', observed=True).sum() / logdays,
+            'socmed_daily_appevents': self._per_id('socmed_events', logdays),
+            'socmed_daily_notification_taps': self._per_id('socmed_taps', logdays),
+            'socmed_daily_duration': self._per_id('socmed_duration', logdays, count_column='socmed_events'),
+            'calls_daily_appevents': self._per_id('calls_events', logdays),
+            'calls_daily_duration': self._per_id('calls_duration', logdays, count_column='calls_events'),
+        }).rename_axis('id')
+
+    def get_memory_features(self) -> pd.DataFrame:
+        """
+        Returns the memory features (see features_calc_memory), except for median_same_app_s
+        """
+
+        logdays = self.get_days()
+        gaps = self.__gaps__
+
+        memory = pd.DataFrame({
+            'avg_daily_search': self._per_id('search_events', logdays),
+            'avg_daily_search_duration': self._per_id('search_duration', logdays, count_column='search_events'),
+            'avg_daily_notes': self._per_id('notes_events', logdays),
+            'avg_daily_notes_duration': self._per_id('notes_duration', logdays, count_column='notes_events'),
+            'sessions_empty_pct': self.__id_sessions__ / self.__session_counts__,
+            'mean_same_app_s': gaps['sum'] / gaps['n'],
+            'std_same_app_s': np.sqrt(((gaps['sumsq'] - gaps['sum'] ** 2 / gaps['n']) /
+                                       (gaps['n'] - 1)).clip(lower=0).where(gaps['n'] > 1)),
+        }, index=logdays.index).rename_axis('id')
+
+        return memory.reindex(columns=memory.columns if len(self.__session_counts__) else
+                              memory.columns.drop('sessions_empty_pct'))
+
+    def get_sleep_features(self) -> pd.DataFrame:
+        """
+        Returns the sleep features (see features_calc_sleep)
+        """
+
+        start_stop = self.__sleep_days__
+        start_h = (start_stop['start_correct'].dt.hour + 4).groupby(level=0, observed=True)
+        end_h = (start_stop['end_correct'].dt.hour + 4).groupby(level=0, observed=True)
+
+        sleep = pd.DataFrame({
+            'sleep_start_mean': start_h.mean(),
+            'sleep_start_median': start_h.median(),
+            'sleep_start_std': start_h.std(),
+            'sleep_stop_mean': end_h.mean(),
+            'sleep_stop_median': end_h.median(),
+            'sleep_stop_std': end_h.std(),
+        })
+
+        # Hourly averages over the sleep window, empty hours included (see calc_use_during_sleep)
+        hours = count_window_hours(first=self.__span__['first'], last=self.__span__['last'],
+                                   start=self.__sleep_window__[0], end=self.__sleep_window__[1])
+        hours = hours[hours > 0]
+        sleep_sums = self.__days__[['sleep_events', 'sleep_duration']].groupby(level='id', observed=True).sum()
+        sleep['sleep_avg_apps_per_hour'] = sleep_sums['sleep_events'] / hours
+        sleep['sleep_avg_duration_per_hour_s'] = sleep_sums['sleep_duration'] / hours
+
+        return sleep.loc[sleep.index.isin(hours.index)].rename_axis('id')
+
+    def finalize(self) -> pd.DataFrame:
+        """
+        Returns the anhedonia, memory and sleep features of all ids
+        """
+
+        return self.get_anhedonia_features().join(self.get_memory_features()).join(self.get_sleep_features())
+
+    # Getters (see Appevents) #
+    ###########################
+
+    def get_users(self) -> list:
+        """
+        Returns a list of unique users
+        """
+
+        return list(self.__days__.index.unique(level='id'))
+
+    def get_days(self) -> pd.Series:
+        """
+        Returns the number of unique days
+        """
+
+        return self.__days__.groupby(level='id', observed=True).size().rename('days')
+
+    def get_daily_events(self) -> pd.Series:
+        """
+        Returns number of appevents per day
+        """
+
+        return self.__days__['events'].groupby(level='id', observed=True).mean().rename('daily_events')
+
+    def get_daily_duration(self) -> pd.Series:
+        """
+        Returns duration per day
+        """
+
+        return self.__days__['duration'].groupby(level='id', observed=True).mean().rename('daily_durations')
+
+    def get_daily_active_sessions(self) -> pd.Series:
+        """
+        Returns daily number of sessions based on appevent activity
+        """
+
+        return self.__days__['sessions'].groupby(level='id', observed=True).mean().rename('daily_active_sessions')
+
+    def get_daily_number_of_apps(self) -> pd.Series:
+
+        return self.__days__['apps'].groupby(level='id', observed=True).mean().rename('daily_number_of_apps')
+
+    def get_daily_events_sd(self) -> pd.Series:
+        """
+        Returns standard deviation on number of events per day
+        """
+
+        return self.__days__['events'].groupby(level='id', observed=True).std().rename('daily_events_sd')
+
+    def get_daily_duration_sd(self) -> pd.Series:
+        """
+        Returns standard deviation on duration per days
+        """
+
+        return self.__days__['duration'].groupby(level='id', observed=True).std().rename('daily_durations_sd')
+
+    def get_daily_active_sessions_sd(self) -> pd.Series:
+        """
+        Returns standard deviation on daily number of sessions based on appevent activity
+        """
+
+        return self.__days__['sessions'].groupby(level='id', observed=True).std().rename('daily_active_sessions_sd')
+
+    def get_daily_number_of_apps_sd(self) -> pd.Series:
+
+        return self.__days__['apps'].groupby(level='id', observed=True).std().rename('daily_number_of_apps_sd')
+
+
+if __name__ == "__main__":
+    ###########
+    # EXAMPLE #
+    ###########
+
+    hlp.hi()
+    hlp.set_param(log_level=1)
+
+    from mobiledna.core.appevents import Appevents
+
+    ae = Appevents.load_data(path='../../data/appevents.csv', sep=';')
+    data = ae.get_data()
+
+    # Feed the data day by day, finalize on demand
+    inc = IncrementalFeatures()
+    for day, new_rows in data.groupby(data.startTime.dt.date):
+        inc.update(df=new_rows)
+
+    print(inc.finalize())
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+"""
+    __  ___      __    _ __     ____  _   _____
+   /  |/  /___  / /_  (_) /__  / __ \/ | / /   |
+  / /|_/ / __ \/ __ \/ / / _ \/ / / /  |/ / /| |
+ / /  / / /_/ / /_/ / / /  __/ /_/ / /|  / ___ |
+/_/  /_/\____/_.___/_/_/\___/_____/_/ |_/_/  |_|
+
+LAZY APPEVENTS CLASS
+Out-of-core counterpart of the Appevents class, backed by a (partitioned) Parquet dataset
+"""
+
+from typing import Callable
+
+import pandas as pd
+
+import mobiledna.core.help as hlp
+from mobiledna.core.appevents import Appevents
+from mobiledna.core.help import log
+
+# Columns every scan needs to rebuild appevents (dates, durations)
+BASE_COLUMNS = ['id', 'application', 'startTime', 'endTime']
+
+
+class LazyAppevents:
+    """
+    Wraps a Parquet file or dataset directory (see Appevents.save_data with partition_by) without loading it.
+    Filters are recorded in a plan; getters stream the dataset in batches, run the plan on every batch and
+    combine the partial aggregates, so memory scales with the result rather than with the data.
+    """
+
+    def __init__(self, path: str, batch_size=1_000_000, users=None, date_range=None, applications=None):
+
+        self.__path__ = path
+        self.__batch_size__ = batch_size
+        self.__dataset__ = hlp.open_dataset(path)
+
+        # Query plan: list of filter stages, applied one after the other (like chained Appevents.filter calls)
+        self.__plan__ = []
+
+        if users is not None or date_range or applications is not None:
+            self.__plan__.append(dict(users=hlp.to_list(users), date_range=date_range,
+                                      application=hlp.to_list(applications)))
+
+    def filter(self, users=None, category=None, application=None, from_push=None, day_types=None, time_of_day=None,
+               hour_limits=None, date_range=None, inplace=False):
+        """
+        Add a filter stage to the query plan (nothing is read yet). Ids, applications and dates are pushed down
+        to the dataset layer, other filters are applied per batch.
+
+        :param date_range: tuple with first and last date to keep (included)
+        :param inplace: extend the plan of this object, or return a new LazyAppevents object
+        :return: LazyAppevents object
+        """
+
+        stage = dict(users=hlp.to_list(users), category=category, application=hlp.to_list(application),
+                     from_push=from_push, day_types=day_types, time_of_day=time_of_day, hour_limits=hour_limits,
+                     date_range=date_range)
+        stage = {key: value for key, value in stage.items() if value is not None}
+
+        lazy = self if inplace else self.copy()
+        if stage:
+            lazy.__plan__.append(stage)
+
+        return lazy
+
+    def copy(self):
+        """
+        Return a LazyAppevents object on the same dataset, with a copy of the query plan
+        """
+
+        lazy = LazyAppevents.__new__(LazyAppevents)
+        lazy.__dict__.update(self.__dict__)
+        lazy.__plan__ = [dict(stage) for stage in self.__plan__]
+
+        return lazy
+
+    # Execution #
+    #############
+
+    def _get_expression(self):
+        """
+        Combine the pushdown filters (ids, applications, dates) of all plan stages into one expression
+        """
+
+        expression = None
+
+        for stage in self.__plan__:
+
+            # Category takes precedence over application (see Appevents.filter)
+            applications = None if stage.get('category') else stage.get('application')
+
+            condition = hlp.get_filter_expression(dataset=self.__dataset__, index='appevents',
+                                                  users=stage.get('users'), date_range=stage.get('date_range'),
+                                                  applications=applications)
+
+            if condition is not None:
+                expression = condition if expression is None else expression & condition
+
+        return expression
+
+    def scan(self, func: Callable, columns=None) -> list:
+        """
+        Run the query plan batch by batch and apply a function to every (filtered) batch.
+
+        :param func: function taking an appevents data frame and returning a partial result
+        :param columns: extra columns the function needs (only these and the base columns are decoded)
+        :return: list of partial results
+        """
+
+        # Only decode what we need
+        names = self.__dataset__.schema.names
+        needed = BASE_COLUMNS + [column for column in (columns or []) if column not in BASE_COLUMNS]
+        for stage in self.__plan__:
+            if stage.get('from_push'):
+                needed.append('notification')
+        needed = [column for column in dict.fromkeys(needed) if column in names]
+
+        # Filters that can't be pushed down
+        row_filters = [{key: value for key, value in stage.items() if key not in ('users', 'date_range')}
+                       for stage in self.__plan__]
+        row_filters = [stage for stage in row_filters if stage]
+
+        partials = []
+
+        for batch in self.__dataset__.to_batches(columns=needed, filter=self._get_expression(),
+                                                 batch_size=self.__batch_size__):
+
+            if batch.num_rows == 0:
+                continue
+
+            ae = Appevents(data=hlp.restore_partition_columns(df=batch.to_pandas(), dataset=self.__dataset__))
+
+            for stage in row_filters:
+                ae.filter(**stage, inplace=True)
+
+            data = ae.get_data()
+
+            if not data.empty:
+                partials.append(func(data))
+
+        log(f'Scanned {self.__path__} in {len(partials)} batches.', lvl=3)
+
+        return partials
+
+    def collect(self) -> Appevents:
+        """
+        Run the query plan and materialize the result as an (in-memory) Appevents object
+        """
+
+        partials = self.scan(func=lambda df: df, columns=self.__dataset__.schema.names)
+
+        if not partials:
+            return Appevents(data=pd.DataFrame(columns=BASE_COLUMNS))
+
+        return Appevents(data=pd.concat(partials, ignore_index=True))
+
+    def _daily(self, value: str, how: str, stat: str, series_unit=None, **filters) -> pd.Series:
+        """
+        Per-day aggregate, combined across batches, summarized per id (and series unit).
+
+        :param value: column to aggregate per day
+        :param how: 'count', 'sum' or 'nunique'
+        :param stat: 'mean' or 'std' over days
+        :param series_unit: extra grouping column (see Appevents getters)
+        :param filters: filters to apply first
+        :return: series
+        """
+
+        lazy = self.filter(**filters) if filters else self
+
+        groupby_list = ['id', series_unit] if series_unit else ['id']
+        keys = groupby_list + ['startDate'] if 'startDate' not in groupby_list else groupby_list
+
+        # Distinct counts don't add up across batches: keep distinct key tables instead
+        if how == 'nunique':
+            partials = lazy.scan(func=lambda df: df[keys + [value]].drop_duplicates(),
+                                 columns=[value] + groupby_list)
+            if not partials:
+                return pd.Series(dtype=float)
+            daily = pd.concat(partials, ignore_index=True).drop_duplicates().groupby(keys, observed=True).size()
+
+        else:
+            partials = lazy.scan(func=lambda df: getattr(df.groupby(keys, observed=True)[value], how)(),
+                                 columns=[value] + groupby_list)
+            if not partials:
+                return pd.Series(dtype=float)
+            daily = pd.concat(partials).groupby(level=list(range(len(keys))), observed=True).sum()
+
+        daily = daily.rename(value).reset_index()
+
+        return getattr(daily.groupby(groupby_list, observed=True)[value], stat)()
+
+    @staticmethod
+    def _name(base: str, category=None, application=None, day_types=None, time_of_day=None) -> str:
+
+        return (base +
+                (f'_{category}' if category else '') +
+                (f'_{application}' if application else '') +
+                (f'_{day_types}' if day_types else '') +
+                (f'_{time_of_day}' if time_of_day else '')).lower()
+
+    # Getters #
+    ###########
+
+    def get_users(self) -> list:
+        """
+        Returns a list of unique users
+        """
+
+        partials = self.scan(func=lambda df: pd.Series(df.id.unique()))
+
+        return list(pd.concat(partials).unique()) if partials else []
+
+    def get_days(self) -> pd.Series:
+        """
+        Returns the number of unique days
+        """
+
+        partials = self.scan(func=lambda df: df[['id', 'startDate']].drop_duplicates())
+
+        if not partials:
+            return pd.Series(dtype=int, name='days')
+
+        return pd.concat(partials, ignore_index=True).drop_duplicates().groupby('id', observed=True).size().rename(
+            'days')
+
+    def get_events(self) -> pd.Series:
+        """
+        Returns the number of appevents
+        """
+
+        partials = self.scan(func=lambda df: df.groupby('id', observed=True).application.count())
+
+        if not partials:
+            return pd.Series(dtype=int, name='events')
+
+        return pd.concat(partials).groupby(level=0, observed=True).sum().rename('events')
+
+    def get_durations(self) -> pd.Series:
+        """
+        Returns the total duration
+        """
+
+        partials = self.scan(func=lambda df: df.groupby('id', observed=True).duration.sum())
+
+        if not partials:
+            return pd.Series(dtype=float, name='durations')
+
+        return pd.concat(partials).groupby(level=0, observed=True).sum().rename('durations')
+
+    # Compound getters #
+    ####################
+
+    def get_daily_events(self, category=None, application=None, from_push=None, day_types=None,
+                         time_of_day=None, hour_limits=None, series_unit=None) -> pd.Series:
+        """
+        Returns number of appevents per day
+        """
+
+        name = self._name('daily_events', category, application, day_types, time_of_day)
+
+        return self._daily(value='application', how='count', stat='mean', series_unit=series_unit,
+                           category=category, application=application, from_push=from_push, day_types=day_types,
+                           time_of_day=time_of_day, hour_limits=hour_limits).rename(name)
+
+    def get_daily_duration(self, category=None, application=None, from_push=None, day_types=None,
+                           time_of_day=None, hour_limits=None, series_unit=None) -> pd.Series:
+        """
+        Returns duration per day
+        """
+
+        name = self._name('daily_durations', category, application, day_types, time_of_day)
+
+        return self._daily(value='duration', how='sum', stat='mean', series_unit=series_unit,
+                           category=category, application=application, from_push=from_push, day_types=day_types,
+                           time_of_day=time_of_day, hour_limits=hour_limits).rename(name)
+
+    def get_daily_active_sessions(self, series_unit=None) -> pd.Series:
+        """
+        Returns daily number of sessions based on appevent activity
+        """
+
+        return self._daily(value='session', how='nunique', stat='mean',
+                           series_unit=series_unit).rename('daily_active_sessions')
+
+    def get_daily_events_sd(self, category=None, application=None, from_push=None, day_types=None,
+                            time_of_day=None, series_unit=None) -> pd.Series:
+        """
+        Returns standard deviation on number of events per day
+        """
+
+        name = self._name('daily_events_sd', category, application, day_types, time_of_day)
+
+        return self._daily(value='application', how='count', stat='std', series_unit=series_unit,
+                           category=category, application=application, from_push=from_push, day_types=day_types,
+                           time_of_day=time_of_day).rename(name)
+
+    def get_daily_duration_sd(self, category=None, application=None, from_push=None, day_types=None,
+                              time_of_day=None, series_unit=None) -> pd.Series:
+        """
+        Returns standard deviation on duration per days
+        """
+
+        name = self._name('daily_durations_sd', category, application, day_types, time_of_day)
+
+        return self._daily(value='duration', how='sum', stat='std', series_unit=series_unit,
+                           category=category, application=application, from_push=from_push, day_types=day_types,
+                           time_of_day=time_of_day).rename(name)
+
+    def get_daily_active_sessions_sd(self, series_unit=None) -> pd.Series:
+        """
+        Returns standard deviation on daily number of sessions based on appevent activity
+        """
+
+        return self._daily(value='session', how='nunique', stat='std',
+                           series_unit=series_unit).rename('daily_active_sessions_sd')
+
+    def get_daily_number_of_apps(self, series_unit=None) -> pd.Series:
+
+        return self._daily(value='application', how='nunique', stat='mean',
+                           series_unit=series_unit).rename('daily_number_of_apps')
+
+    def get_daily_number_of_apps_sd(self, series_unit=None) -> pd.Series:
+
+        return self._daily(value='application', how='nunique', stat='std',
+                           series_unit=series_unit).rename('daily_number_of_apps_sd')
+
+
+if __name__ == "__main__":
+    ###########
+    # EXAMPLE #
+    ###########
+
+    hlp.hi()
+    hlp.set_param(log_level=1)
+
+    # Scan a partitioned dataset (see Appevents.save_data) and only keep two weeks of data
+    ae = LazyAppevents(path='../../data/appevents_dataset', date_range=('2021-01-04', '2021-01-17'))
+
+    print(ae.filter(category='social').get_daily_events())
@@ -17,12 +17,11 @@ import pickle
 from collections import Counter
 
 import pandas as pd
-from tqdm import tqdm
 
 import mobiledna.core.help as hlp
 from mobiledna.core.annotate import add_category, add_time_of_day_annotation, add_date_annotation
 from mobiledna.core.appevents import Appevents
-from mobiledna.core.help import log
+from mobiledna.core.help import log, restrict_to_dates
 
 pd.set_option('display.max_rows', 500)
 pd.set_option('display.max_columns', 500)
@@ -101,7 +100,8 @@ class Notifications:
 
         return object
 
-    def save_data(self, dir: str, name: str, csv=False, pickle=False, parquet=True):
+    def save_data(self, dir: str, name: str, csv=False, pickle=False, parquet=True, partition_by=None,
+                  row_group_size=None, write_statistics=True):
         """
         Save data from Appevents object to data frame
         :param dir: directory to save
@@ -109,52 +109,35 @@ class Notifications:
         :param csv: csv format
         :param pickle: pickle format
         :param parquet: parquet format
+        :param partition_by: write parquet as a dataset partitioned by 'id', 'month' or both
+        :param row_group_size: maximum number of rows per parquet row group
+        :param write_statistics: store parquet column statistics
         :return: None
         """
 
-        hlp.save(df=self.__data__, dir=dir, name=name, csv_file=csv, pickle=pickle, parquet=parquet)
+        hlp.save(df=self.__data__, dir=dir, name=name, csv_file=csv, pickle=pickle, parquet=parquet,
+                 partition_by=partition_by, row_group_size=row_group_size, write_statistics=write_statistics)
 
     @hlp.time_it
-    def sync(self, ae: Appevents, inplace=True):
+    def sync(self, ae: Appevents, inplace=True, n_jobs=1):
         """
         Restrict timestamps to date ranges as they occur in the Appevents index
         :param ae: Appevents object
         :param inplace: return new data frame or manipulate object data frame
+        :param n_jobs: number of processes to spread the ids over
         :return: data frame or None, depending on `inplace`
         """
 
-        # Get dates from Appevents
-        dates = ae.get_dates()
-
-        # First filter on users (some may have dropped out due to our criteria)
-        users = ae.get_users()
-        self.filter(users=users, inplace=True)
-
-        # Get first and last date (per id)
-        firsts = dates.apply(min)
-        lasts = dates.apply(max)
+        # Get first and last date (per id) as a small table (ids that dropped out of Appevents are dropped too)
+        window = ae.get_data().groupby('id', observed=True).startDate.agg(['min', 'max'])
 
         # Count for logging
         before = len(self.__data__)
 
-        # Helper function: take df and filter 'time_col' on (start, stop) range
-        def filter_timestamps(df: pd.DataFrame, start: pd.Timestamp, stop: pd.Timestamp,
-                              time_col='time') -> pd.DataFrame:
-
-            # Define filter criterion (edges included)
-            criterion = (start <= df[time_col].dt.date) & (df[time_col].dt.date <= stop)
-
-            # Filter the df and return it
-            df = df.loc[criterion]
-            return df
-
         # Apply to object
-        tqdm.pandas(desc="Syncing Notifications to Appevents")
-        result = self.__data__.groupby('id').progress_apply(lambda df: filter_timestamps(df,
-                                                                                         start=firsts[df.id.iloc[0]],
-                                                                                         stop=lasts[df.id.iloc[
-                                                                                             0]])).reset_index(
-            drop=True)
+        result = hlp.apply_by_id(df=self.__data__, func=restrict_to_dates, n_jobs=n_jobs, by_group=False,
+                                 desc="Syncing Notifications to Appevents", firsts=window['min'],
+                                 lasts=window['max'], col='time').reset_index(drop=True)
 
         # Count for logging
         after = len(result)
@@ -264,9 +247,9 @@ class Notifications:
 
         return self
 
-    def add_time_of_day(self, time_col='startTime'):
+    def add_time_of_day(self, time_col='time', bins=None, labels=None):
 
-        self.__data__ = add_time_of_day_annotation(df=self.__data__, time_cols=time_col)
+        self.__data__ = add_time_of_day_annotation(df=self.__data__, time_cols=time_col, bins=bins, labels=labels)
 
         return self
 
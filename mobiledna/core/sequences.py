@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+    __  ___      __    _ __     ____  _   _____
+   /  |/  /___  / /_  (_) /__  / __ \/ | / /   |
+  / /|_/ / __ \/ __ \/ / / _ \/ / / /  |/ / /| |
+ / /  / / /_/ / /_/ / / /  __/ /_/ / /|  / ___ |
+/_/  /_/\____/_.___/_/_/\___/_____/_/ |_/_/  |_|
+
+SESSION SEQUENCES CLASS
+Ragged (CSR) layout of the application sequences in phone sessions
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class SessionSequences:
+    """
+    Application sequences of all sessions, stored as one flat array of application codes:
+    the apps of session i are codes[offsets[i]:offsets[i + 1]], in order of use.
+    """
+
+    def __init__(self, offsets: np.ndarray, codes: np.ndarray, applications: np.ndarray, sessions: np.ndarray):
+
+        self.offsets = offsets
+        self.codes = codes
+        self.applications = applications
+        self.sessions = sessions
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, session_col='session', app_col='application'):
+        """
+        Build session sequences with a single (stable) sort on session codes.
+        Sessions appear in order of first appearance in the data frame, apps in row order.
+
+        :param df: appevents data frame
+        :param session_col: session column
+        :param app_col: application column
+        :return: SessionSequences object
+        """
+
+        # Integer codes for sessions and apps (rows without session are left out)
+        session_codes, sessions = pd.factorize(df[session_col])
+
+        if isinstance(df[app_col].dtype, pd.CategoricalDtype):
+            app_codes = df[app_col].cat.codes.values
+            applications = np.asarray(df[app_col].cat.categories, dtype=object)
+        else:
+            app_codes, applications = pd.factorize(df[app_col])
+            applications = np.asarray(applications, dtype=object)
+
+        # Group rows per session, keeping row order within sessions
+        order = np.argsort(session_codes, kind='stable')
+        order = order[session_codes[order] >= 0]
+
+        # Session boundaries
+        offsets = np.zeros(len(sessions) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(session_codes[order], minlength=len(sessions)), out=offsets[1:])
+
+        return cls(offsets=offsets, codes=np.asarray(app_codes)[order], applications=applications,
+                   sessions=np.asarray(sessions))
+
+    def __len__(self) -> int:
+
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> tuple:
+
+        return tuple(self._labels()[self.codes[self.offsets[i]:self.offsets[i + 1]]])
+
+    def __iter__(self):
+
+        return iter(self.to_tuples())
+
+    def _labels(self) -> np.ndarray:
+        """
+        Application labels, with a trailing NaN for missing apps (code -1)
+        """
+
+        return np.append(self.applications, np.nan)
+
+    def lengths(self) -> np.ndarray:
+        """
+        Returns the number of appevents per session
+        """
+
+        return np.diff(self.offsets)
+
+    def to_tuples(self) -> list:
+        """
+        Materialize the sequences as a list of tuples of application names
+        """
+
+        labels = self._labels()[self.codes].tolist()
+
+        return [tuple(labels[start:stop]) for start, stop in zip(self.offsets[:-1], self.offsets[1:])]
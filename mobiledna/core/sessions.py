@@ -15,12 +15,12 @@ SESSIONS CLASS
 
 import pandas as pd
 import pickle
-from tqdm import tqdm
 
 import mobiledna.core.help as hlp
 from mobiledna.core.annotate import add_category, add_date_annotation, add_time_of_day_annotation
 from mobiledna.core.appevents import Appevents
-from mobiledna.core.help import log, remove_first_and_last, longest_uninterrupted
+from mobiledna.core.help import log, remove_first_and_last, longest_uninterrupted, restrict_to_dates, \
+    select_first_days
 
 
 pd.set_option('display.max_rows', 500)
@@ -92,7 +92,8 @@ class Sessions:
 
         return object
 
-    def save_data(self, dir: str, name: str, csv=False, pickle=False, parquet=True):
+    def save_data(self, dir: str, name: str, csv=False, pickle=False, parquet=True, partition_by=None,
+                  row_group_size=None, write_statistics=True):
         """
         Save data from Sessions object to data frame
         :param dir: directory to save
@@ -100,10 +101,14 @@ class Sessions:
         :param csv: csv format
         :param pickle: pickle format
         :param parquet: parquet format
+        :param partition_by: write parquet as a dataset partitioned by 'id', 'month' or both
+        :param row_group_size: maximum number of rows per parquet row group
+        :param write_statistics: store parquet column statistics
         :return: None
         """
 
-        hlp.save(df=self.__data__, dir=dir, name=name, csv_file=csv, pickle=pickle, parquet=parquet)
+        hlp.save(df=self.__data__, dir=dir, name=name, csv_file=csv, pickle=pickle, parquet=parquet,
+                 partition_by=partition_by, row_group_size=row_group_size, write_statistics=write_statistics)
 
     def to_pickle(self, path: str):
         """
@@ -129,15 +134,15 @@ class Sessions:
 
         return Sessions(data=new_data)
 
-    def add_date_type(self, date_cols='date', holidays_separate=False):
+    def add_date_type(self, date_cols='startDate', holidays_separate=False):
 
         self.__data__ = add_date_annotation(df=self.__data__, date_cols=date_cols, holidays_separate=holidays_separate)
 
         return self
 
-    def add_time_of_day(self, time_col='startTime'):
+    def add_time_of_day(self, time_col='startTime', bins=None, labels=None):
 
-        self.__data__ = add_time_of_day_annotation(df=self.__data__, time_cols=time_col)
+        self.__data__ = add_time_of_day_annotation(df=self.__data__, time_cols=time_col, bins=bins, labels=labels)
 
         return self
 
@@ -178,27 +183,25 @@ class Sessions:
         else:
             return data
 
-    def strip(self, uninterrupted=None, number_of_days=None, min_log_days=None):
+    def strip(self, uninterrupted=None, number_of_days=None, min_log_days=None, n_jobs=1):
         if self.__stripped__:
             log('Already stripped this Sessions object!', lvl=1)
             return self
 
         # Cut off head and tail
-        tqdm.pandas(desc="Cutting off head and tail", position=0, leave=True)
-        self.__data__ = self.__data__.groupby('id').progress_apply(lambda df: remove_first_and_last(df=df)).reset_index(
-            drop=True)
+        self.__data__ = hlp.apply_by_id(df=self.__data__, func=remove_first_and_last, n_jobs=n_jobs, by_group=False,
+                                        desc="Cutting off head and tail", by='id').reset_index(drop=True)
 
         # Keep only the longest uninterrupted sequence:
         if uninterrupted:
             # Get longest uninterrupted sequence
-            tqdm.pandas(desc="Finding longest uninterrupted sequence", position=0, leave=True)
-            self.__data__ = self.__data__.groupby('id').progress_apply(
-                lambda df: longest_uninterrupted(df=df)).reset_index(
-                drop=True)
+            self.__data__ = hlp.apply_by_id(df=self.__data__, func=longest_uninterrupted, n_jobs=n_jobs,
+                                            by_group=False,
+                                            desc="Finding longest uninterrupted sequence").reset_index(drop=True)
 
         # If a number of days is set
         if number_of_days:
-            self.select_n_first_days(n=number_of_days, inplace=True)
+            self.select_n_first_days(n=number_of_days, inplace=True, n_jobs=n_jobs)
 
         # If a minimum number of log days is set
         if min_log_days:
@@ -209,47 +212,62 @@ class Sessions:
 
         return self
 
+    def select_n_first_days(self, n: int, inplace=False, n_jobs=1):
+        """
+        Select the first n days in the data frame, either inplace or on a copy that is returned.
+
+        :param n: number of days
+        :param inplace: modify object or return copy of data
+        :param n_jobs: number of processes to spread the ids over
+        :return: modified Sessions object or modified copy of data frame
+        """
+
+        selection = hlp.apply_by_id(df=self.__data__, func=select_first_days, n_jobs=n_jobs, by_group=False,
+                                    desc="Selecting first days", n=n, by='id').reset_index(drop=True)
+
+        if inplace:
+            self.__data__ = selection
+            return self
+
+        else:
+            return selection
+
+    def impose_min_days(self, n: int, inplace=False):
+        """
+        Filter out users that don't have a minimum of n log days
+        :param n: number of log days
+        :param inplace: either manipulate object, or return copy
+        :return: object or copy, depending on inplace parameter
+        """
+
+        selection = hlp.impose_min_days(df=self.__data__, n=n)
+
+        if inplace:
+            self.__data__ = selection
+            return self
+        else:
+            return selection
+
     @hlp.time_it
-    def sync(self, ae: Appevents, inplace=True):
+    def sync(self, ae: Appevents, inplace=True, n_jobs=1):
         """
         Restrict timestamps to date ranges as they occur in the Appevents index
         :param ae: Appevents object
         :param inplace: return new data frame or manipulate object data frame
+        :param n_jobs: number of processes to spread the ids over
         :return: data frame or None, depending on `inplace`
         """
 
-        # Get dates from Appevents
-        dates = ae.get_dates()
-
-        # First filter on users (some may have dropped out due to our criteria)
-        users = ae.get_users()
-        self.filter(users=users, inplace=True)
-
-        # Get first and last date (per id)
-        firsts = dates.apply(min)
-        lasts = dates.apply(max)
+        # Get first and last date (per id) as a small table (ids that dropped out of Appevents are dropped too)
+        window = ae.get_data().groupby('id', observed=True).startDate.agg(['min', 'max'])
 
         # Count for logging
         before = len(self.__data__)
 
-        # Helper function: take df and filter 'time_col' on (start, stop) range
-        def filter_timestamps(df: pd.DataFrame, start: pd.Timestamp, stop: pd.Timestamp,
-                              time_col='startTime') -> pd.DataFrame:
-
-            # Define filter criterion (edges included)
-            criterion = (start <= df[time_col].dt.date) & (df[time_col].dt.date <= stop)
-
-            # Filter the df and return it
-            df = df.loc[criterion]
-            return df
-
         # Apply to object
-        tqdm.pandas(desc="Syncing Sessions to Appevents")
-        result = self.__data__.groupby('id').progress_apply(lambda df: filter_timestamps(df,
-                                                                                         start=firsts[df.id.iloc[0]],
-                                                                                         stop=lasts[df.id.iloc[
-                                                                                             0]])).reset_index(
-            drop=True)
+        result = hlp.apply_by_id(df=self.__data__, func=restrict_to_dates, n_jobs=n_jobs, by_group=False,
+                                 desc="Syncing Sessions to Appevents", firsts=window['min'],
+                                 lasts=window['max'], col='startTime').reset_index(drop=True)
 
         # Count for logging
         after = len(result)
@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mobiledna.core.help as hlp
+
+hlp.set_param(log_level=0, cache_dir=os.path.join(os.path.dirname(hlp.__file__), os.pardir, 'cache'))
+
+
+@pytest.fixture(scope='session')
+def appevents() -> pd.DataFrame:
+    """
+    Synthetic appevents: 8 users, 30 days, known apps (incl. search and notes apps), with gaps in the logging days
+    and sessions split on 30 minutes without use
+    """
+
+    rng = np.random.default_rng(0)
+    n = 6000
+
+    apps = list(hlp.load_meta(copy=False))[:150] + ['com.whatsapp', 'com.google.android.googlequicksearchbox',
+                                                   'com.google.android.keep', 'unknown.app']
+    start = pd.Timestamp('2021-11-20') + pd.to_timedelta(rng.integers(0, 30 * 86400, n), 's')
+
+    df = pd.DataFrame({'id': rng.choice([f'u{i}' for i in range(8)], n),
+                       'application': rng.choice(apps, n),
+                       'startTime': start,
+                       'endTime': start + pd.to_timedelta(rng.integers(1, 900, n), 's'),
+                       'notification': rng.random(n) < .1})
+
+    # Users with days without logging
+    df = df.loc[~((df.id == 'u0') & df.startTime.dt.day.isin([1, 2, 15]))]
+    df = df.loc[~((df.id == 'u1') & (df.startTime.dt.day > 10))]
+
+    df = df.sort_values(['id', 'startTime']).reset_index(drop=True)
+
+    # A new session after 30 minutes without a start (some run past midnight)
+    new_session = df.groupby('id').startTime.diff().gt(pd.Timedelta(minutes=30))
+    df.insert(4, 'session', new_session.groupby(df.id).cumsum().astype(str))
+
+    return df
@@ -0,0 +1,106 @@
+import json
+import os
+
+import pytest
+from google_play_scraper.exceptions import NotFoundError
+
+import mobiledna.core.help as hlp
+from mobiledna.core import annotate as an
+
+
+class StubStore:
+    """
+    Local stand-in for google_play_scraper.app, recording the apps it was asked for
+    """
+
+    def __init__(self, missing=(), interrupt=()):
+        self.missing = missing
+        self.interrupt = interrupt
+        self.calls = []
+
+    def __call__(self, app_name, lang=None, country=None):
+        self.calls.append(app_name)
+
+        if app_name in self.interrupt:
+            raise KeyboardInterrupt
+        if app_name in self.missing:
+            raise NotFoundError(app_name)
+
+        return {'title': f'{app_name}: stub', 'developer': 'stub', 'genre': 'Tools', 'minInstalls': 10, 'score': 4.}
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """
+    Temporary cache directory (app meta data and scrape log)
+    """
+
+    monkeypatch.setattr(hlp, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(hlp, 'META_FILE', 'app_meta.npy')
+
+    return tmp_path
+
+
+def scrape(app_names, cache_dir, fetch, **kwargs):
+    return an.scrape_play_store(app_names=app_names, fetch=fetch, max_workers=1, rate_limit=None, retries=0,
+                                log_path=str(cache_dir / an.SCRAPE_LOG), **kwargs)
+
+
+def test_scrape_against_stub(cache):
+    fetch = StubStore(missing=['stub.missing'])
+    known = {'stub.known': {'name': 'known', 'genre': 'Tools'}}
+
+    meta, unknown = scrape(['stub.known', 'stub.new', 'stub.missing'], cache, fetch, cache=known)
+
+    assert fetch.calls.count('stub.new') == 1 and 'stub.known' not in fetch.calls
+    assert meta['stub.new']['name'] == 'stub.new' and meta['stub.known'] == known['stub.known']
+    assert unknown == ['stub.missing']
+
+    # Stored in the (temporary) cache, the log is removed
+    assert set(hlp.load_meta()) == {'stub.known', 'stub.new', 'stub.missing'}
+    assert not os.path.exists(cache / an.SCRAPE_LOG)
+
+
+def test_scrape_resumes_after_interrupt(cache):
+    app_names = ['stub.first', 'stub.stop', 'stub.last']
+
+    with pytest.raises(KeyboardInterrupt):
+        scrape(app_names, cache, StubStore(interrupt=['stub.stop']), cache={})
+
+    with open(cache / an.SCRAPE_LOG) as file:
+        logged = [json.loads(line)['app'] for line in file]
+    assert 'stub.first' in logged and 'stub.stop' not in logged
+
+    # The next run only fetches what wasn't logged, and keeps the logged apps
+    fetch = StubStore()
+    meta, _ = scrape(app_names, cache, fetch, cache={})
+
+    assert 'stub.first' not in fetch.calls and 'stub.stop' in fetch.calls
+    assert set(meta) == set(app_names)
+
+
+def test_overwrite_keeps_logged_apps(cache):
+    with open(cache / an.SCRAPE_LOG, 'w') as file:
+        file.write(json.dumps({'app': 'stub.logged', 'meta': {'name': 'logged', 'genre': 'Tools'}}) + '\n')
+
+    fetch = StubStore()
+    old = {'stub.logged': {'name': 'old', 'genre': 'Tools'}, 'stub.other': {'name': 'old', 'genre': 'Tools'}}
+
+    meta, _ = scrape(['stub.logged', 'stub.other'], cache, fetch, cache=old, overwrite=True)
+
+    assert fetch.calls == ['stub.other']
+    assert meta['stub.logged']['name'] == 'logged' and meta['stub.other']['name'] == 'stub.other'
+
+
+@pytest.mark.parametrize('meta_file', ['app_meta.feather', 'app_meta.parquet'])
+def test_scrape_keeps_columnar_cache(cache, monkeypatch, meta_file):
+    monkeypatch.setattr(hlp, 'META_FILE', meta_file)
+    hlp.save_meta({'stub.a': {'name': 'a', 'genre': 'Tools', 'purchases': 10},
+                   'stub.b': {'name': 'b', 'genre': 'Tools', 'purchases': 20}})
+
+    fetch = StubStore()
+    meta, _ = scrape(['stub.a', 'stub.new'], cache, fetch, cache=hlp.load_meta(copy=False))
+
+    assert fetch.calls == ['stub.new']
+    assert set(hlp.load_meta()) == {'stub.a', 'stub.b', 'stub.new'}
+    assert hlp.load_meta()['stub.b'] == {'name': 'b', 'genre': 'Tools', 'purchases': 20}
@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+from mobiledna.core.appevents import Appevents
+
+PROFILE_GETTERS = {'daily_events': 'get_daily_events', 'daily_durations': 'get_daily_duration',
+                   'daily_active_sessions': 'get_daily_active_sessions',
+                   'daily_number_of_apps': 'get_daily_number_of_apps'}
+
+
+@pytest.fixture(params=['object', 'category'])
+def ae(request, appevents):
+    data = appevents.copy()
+    if request.param == 'category':
+        data['id'] = data.id.astype('category')
+
+    return Appevents(data=data).add_date_type()
+
+
+@pytest.mark.parametrize('series_unit', [None, 'startDOTW'])
+def test_daily_profile_matches_getters(ae, series_unit):
+    profile = ae.daily_profile(series_unit=series_unit)
+
+    for name, getter in PROFILE_GETTERS.items():
+        for sd in ['', '_sd']:
+            expected = getattr(ae, getter + sd)(series_unit=series_unit)
+            pd.testing.assert_series_equal(profile[name + sd].sort_index().astype(float),
+                                           expected.sort_index().astype(float), check_names=False)
+
+
+def test_getters_ignore_id_dtype(appevents):
+    plain = Appevents(data=appevents.copy())
+    categorical = Appevents(data=appevents.assign(id=appevents.id.astype('category')))
+
+    for getter in ['get_days', 'get_daily_events', 'get_daily_duration', 'get_daily_active_sessions',
+                   'get_daily_number_of_apps', 'get_daily_events_sd', 'get_daily_number_of_apps_sd']:
+        result = getattr(categorical, getter)()
+        pd.testing.assert_series_equal(result.set_axis(result.index.astype(str)).astype(float),
+                                       getattr(plain, getter)().astype(float), check_names=False)
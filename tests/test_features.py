@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from mobiledna.core import features as ft
+from mobiledna.core.annotate import add_category
+
+
+@pytest.fixture(scope='module')
+def df(appevents):
+    data = add_category(df=appevents.copy())
+    data['duration'] = (data.endTime - data.startTime).dt.total_seconds()
+    data['date'] = data.startTime.dt.date
+
+    # u2 never uses whatsapp
+    return data.loc[~((data.id == 'u2') & (data.application == 'com.whatsapp'))].reset_index(drop=True)
+
+
+def test_category_measures_of_unused_groups(df):
+    plain = ft.calc_category_measures(df).set_index('id')
+    categorical = ft.calc_category_measures(df.assign(id=df.id.astype('category'))).set_index('id')
+
+    # Like a groupby on the ids: missing for object ids, zero for categorical ids
+    assert np.isnan(plain.loc['u2', 'whatsapp_daily_appevents'])
+    assert categorical.loc['u2', 'whatsapp_daily_appevents'] == 0
+    np.testing.assert_array_equal(categorical.values, plain.fillna(0).values)
+
+
+def test_use_during_sleep_skips_ids_without_appevents(df):
+    plain = ft.calc_use_during_sleep(df)
+    categorical = ft.calc_use_during_sleep(df.assign(id=pd.Categorical(df.id, categories=[*df.id.unique(), 'u9'])))
+
+    pd.testing.assert_frame_equal(categorical.set_axis(categorical.index.astype(str)), plain)
+
+
+def test_masks_follow_the_frame_they_filter(df):
+    ctx = ft.FeatureContext(df=df)
+
+    # Same rows in another order (with a new index), so the context's logdays still hold
+    shuffled = df.sample(frac=1, random_state=0).reset_index(drop=True)
+
+    expected = ft.features_calc_anhedonia(df=df)
+    pd.testing.assert_frame_equal(ft.features_calc_anhedonia(df=shuffled, ctx=ctx), expected)
+    pd.testing.assert_series_equal(ft.calc_daily_appevents(df=shuffled, apps=ft.NOTES_APPS, ctx=ctx),
+                                   ft.calc_daily_appevents(df=df, apps=ft.NOTES_APPS))
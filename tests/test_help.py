@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+import mobiledna.core.help as hlp
+
+
+@pytest.fixture
+def parquet(appevents, tmp_path) -> str:
+    path = str(tmp_path / 'appevents.parquet')
+    appevents.to_parquet(path)
+
+    return path
+
+
+def test_date_filter_needs_time_field(appevents, parquet):
+    data = appevents.drop(columns=['startTime', 'endTime'])
+
+    with pytest.raises(ValueError, match='time fields'):
+        hlp.filter_rows(data, index='appevents', date_range=('2021-11-25', None))
+
+    with pytest.raises(ValueError, match='time fields'):
+        hlp.read_parquet_filtered(parquet, index='logs', date_range=('2021-11-25', None))
+
+
+def test_arrow_backend_needs_pandas_arrow_dtype(parquet, monkeypatch):
+    monkeypatch.delattr(pd, 'ArrowDtype', raising=False)
+
+    with pytest.raises(Exception, match='pandas 1.5'):
+        hlp.read_parquet_filtered(parquet, index='appevents', dtype_backend='pyarrow')
+
+
+@pytest.mark.parametrize('partition_by', ['id', 'month', ['id', 'month']])
+def test_save_dataset_per_user(appevents, tmp_path, partition_by):
+    path = str(tmp_path / 'appevents')
+    users = ['u0', 'u1']
+
+    # Save users one after the other, the last one twice
+    for user in users + users[-1:]:
+        hlp.save_dataset(appevents.loc[appevents.id == user], path=path, partition_by=partition_by)
+
+    data = hlp.read_parquet_filtered(path, index='appevents')
+    expected = appevents.loc[appevents.id.isin(users)]
+
+    if partition_by == 'month':
+        # Appended, so the last user is stored twice
+        expected = pd.concat([expected, appevents.loc[appevents.id == users[-1]]])
+    else:
+        assert len(data) == len(expected)
+
+    assert data.groupby('id').size().to_dict() == expected.groupby('id').size().to_dict()
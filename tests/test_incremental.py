@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from mobiledna.core import features as ft
+from mobiledna.core.annotate import add_category
+from mobiledna.core.appevents import Appevents
+from mobiledna.core.incremental import IncrementalFeatures
+
+GETTERS = ['get_days', 'get_daily_events', 'get_daily_duration', 'get_daily_active_sessions',
+           'get_daily_number_of_apps', 'get_daily_events_sd', 'get_daily_duration_sd', 'get_daily_active_sessions_sd',
+           'get_daily_number_of_apps_sd']
+
+
+@pytest.fixture(scope='module')
+def sessions(appevents) -> pd.DataFrame:
+    """
+    Sessions of the appevents' users, including sessions without appevents
+    """
+
+    rng = np.random.default_rng(1)
+    n = 3000
+    start = pd.Timestamp('2021-11-20') + pd.to_timedelta(rng.integers(0, 30 * 86400, n), 's')
+
+    return pd.DataFrame({'id': rng.choice(appevents.id.unique(), n), 'session on': start})
+
+
+@pytest.fixture(params=['object', 'category'])
+def data(request, appevents, sessions):
+    # u2 never searches
+    df = appevents.loc[~((appevents.id == 'u2') & appevents.application.isin(ft.SEARCH_APPS))].copy()
+    df_s = sessions.copy()
+    if request.param == 'category':
+        categories = sorted(df.id.unique())
+        df['id'] = pd.Categorical(df.id, categories=categories)
+        df_s['id'] = pd.Categorical(df_s.id, categories=categories)
+
+    return df, df_s
+
+
+@pytest.fixture
+def incremental(data):
+    """
+    IncrementalFeatures fed day by day
+    """
+
+    df, df_s = data
+    inc = IncrementalFeatures()
+    for day, new_rows in df.groupby(df.startTime.dt.date):
+        inc.update(df=new_rows, df_s=df_s.loc[df_s['session on'].dt.date == day])
+
+    return inc
+
+
+def assert_same(incremental: pd.DataFrame, full: pd.DataFrame):
+    if 'id' in full.columns:
+        full = full.set_index('id')
+    incremental = incremental.set_axis(incremental.index.astype(str)).sort_index().astype(float)
+    full = full.set_axis(full.index.astype(str)).sort_index().astype(float)
+    pd.testing.assert_frame_equal(incremental, full[incremental.columns], check_names=False)
+
+
+def test_incremental_matches_features(data, incremental):
+    df, df_s = data
+    df = add_category(df=df.copy())
+    df['duration'] = (df.endTime - df.startTime).dt.total_seconds()
+    df['date'] = df.startTime.dt.date
+
+    assert_same(incremental.get_anhedonia_features(), ft.features_calc_anhedonia(df=df))
+    assert_same(incremental.get_memory_features(), ft.features_calc_memory(df=df, df_s=df_s))
+    assert_same(incremental.get_sleep_features(), ft.calc_sleep_pattern(df=df).join(ft.calc_use_during_sleep(df=df)))
+
+
+def test_incremental_matches_getters(data, incremental):
+    ae = Appevents(data=data[0].copy())
+
+    for getter in GETTERS:
+        result, expected = getattr(incremental, getter)(), getattr(ae, getter)()
+        pd.testing.assert_series_equal(result.set_axis(result.index.astype(str)).sort_index().astype(float),
+                                       expected.set_axis(expected.index.astype(str)).sort_index().astype(float),
+                                       check_names=False)
+
+
+def test_update_keeps_input(data):
+    df, df_s = data
+    before = df.copy()
+
+    IncrementalFeatures().update(df=df, df_s=df_s)
+
+    pd.testing.assert_frame_equal(df, before)
+
+
+def test_state_keeps_last_dates_only(data, incremental):
+    last_dates = data[0].groupby('id', observed=True).startTime.max().dt.date
+
+    for seen in incremental.__seen__.values():
+        assert seen and all(date == last_dates[key[0]] for key, date in seen.items())
+
+    last_use = incremental.__last_use__
+    assert (last_use.dt.date.values >= last_dates.reindex(last_use.index.get_level_values('id')).values).all()
@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+from mobiledna.core.appevents import Appevents
+from mobiledna.core.lazy import LazyAppevents
+
+GETTERS = ['get_days', 'get_events', 'get_durations', 'get_daily_events', 'get_daily_duration',
+           'get_daily_active_sessions', 'get_daily_number_of_apps', 'get_daily_events_sd', 'get_daily_duration_sd',
+           'get_daily_active_sessions_sd', 'get_daily_number_of_apps_sd']
+
+
+def assert_same(lazy: pd.Series, eager: pd.Series):
+    lazy = lazy.set_axis(lazy.index.astype(str)).sort_index().astype(float)
+    eager = eager.set_axis(eager.index.astype(str)).sort_index().astype(float)
+    pd.testing.assert_series_equal(lazy, eager, check_names=False)
+
+
+@pytest.fixture(params=['id', 'month', 'file', 'categorical file'])
+def stored(request, appevents, tmp_path):
+    """
+    Appevents stored as id-partitioned dataset, month-partitioned dataset or single parquet file
+    """
+
+    ae = Appevents(data=appevents.copy())
+
+    if request.param in ['id', 'month']:
+        ae.save_data(dir=str(tmp_path), name='appevents', partition_by=request.param)
+        return ae, str(tmp_path / 'appevents')
+
+    data = ae.get_data()
+    if request.param == 'categorical file':
+        data = data.assign(id=data.id.astype('category'))
+    data.to_parquet(tmp_path / 'appevents.parquet')
+
+    return ae, str(tmp_path / 'appevents.parquet')
+
+
+@pytest.mark.parametrize('getter', GETTERS)
+def test_lazy_getters_match_appevents(stored, getter):
+    ae, path = stored
+    lazy = LazyAppevents(path=path, batch_size=500)
+
+    assert_same(getattr(lazy, getter)(), getattr(ae, getter)())
+
+
+def test_lazy_filters_match_appevents(stored):
+    ae, path = stored
+    users = ae.get_data().id.unique()[:3]
+    date_range = ('2021-11-25', '2021-12-10')
+
+    lazy = LazyAppevents(path=path, batch_size=500, users=users, date_range=date_range)
+    eager = Appevents(data=ae.get_data().loc[ae.get_data().id.isin(users) &
+                                             ae.get_data().startDate.between(*date_range)].copy())
+
+    assert_same(lazy.get_daily_events(), eager.get_daily_events())
+    assert_same(lazy.get_daily_number_of_apps(), eager.get_daily_number_of_apps())
+
+
+def test_collect_restores_columns(stored):
+    ae, path = stored
+
+    data = LazyAppevents(path=path).collect().get_data()
+
+    assert list(data.columns) == list(ae.get_data().columns)
+    assert len(data) == len(ae.get_data())